@@ -0,0 +1,55 @@
+# Copyright 2024 Ole Kliemann
+# SPDX-License-Identifier: Apache-2.0
+
+import time
+import asyncio
+from mreventloop import EventLoop, has_event_loop, slot, setEventLoop
+from harness import main
+
+@has_event_loop('event_loop')
+class Counter:
+  def __init__(self):
+    self.count = 0
+
+  @slot
+  def increment(self):
+    self.count += 1
+    return self.count
+
+async def measure(count, **event_loop_args):
+  counter = Counter()
+  setEventLoop(counter, EventLoop(**event_loop_args))
+  for i in range(count):
+    counter.increment()
+  start = time.perf_counter()
+  async with counter.event_loop:
+    pass
+  elapsed = time.perf_counter() - start
+  assert counter.count == count
+  return count / elapsed
+
+async def measureAwait(count):
+  counter = Counter()
+  async with counter.event_loop:
+    start = time.perf_counter()
+    for i in range(count):
+      await counter.increment()
+    elapsed = time.perf_counter() - start
+  return elapsed / count
+
+async def run(results, quick = False, counts = None):
+  counts = counts or ([ 1000, 10000 ] if quick else [ 1000, 100000, 1000000 ])
+  modes = [
+    ('unbatched', {}),
+    ('batch_size=64', { 'batch_size': 64 }),
+    ('batch_time=1ms', { 'batch_size': None, 'batch_time': 0.001 }),
+  ]
+  for count in counts:
+    for name, event_loop_args in modes:
+      rate = await measure(count, **event_loop_args)
+      results.add('slot_enqueue_execute', rate, 'calls/s', calls = count, mode = name)
+  latency = await measureAwait(1000 if quick else 100000)
+  results.add('slot_await_latency', latency * 1e6, 'us')
+
+if __name__ == '__main__':
+  main(run)
@@ -0,0 +1,48 @@
+# Copyright 2024 Ole Kliemann
+# SPDX-License-Identifier: Apache-2.0
+
+from mreventloop import emits, slot, connect, disconnect, has_event_loop
+from mreventloop.events import Event
+from harness import main, best
+
+@emits('events', [ 'changed' ])
+class Emitter:
+  pass
+
+@has_event_loop('event_loop')
+class Receiver:
+  @slot
+  def onChanged(self, value):
+    pass
+
+async def run(results, quick = False, counts = None):
+  for count in counts or [ 1000 if quick else 100000 ]:
+    for listeners in [ 1, 10, 100, 1000 ]:
+      event = Event()
+      for i in range(listeners):
+        event.addListener(lambda value: None)
+      emits = max(count // listeners, 10)
+      def emit():
+        for i in range(emits):
+          event(i)
+      elapsed = best(emit)
+      results.add('event_fan_out', emits * listeners / elapsed, 'calls/s', calls = count, listeners = listeners)
+
+  for receivers in [ 100, 1000 ] if quick else [ 100, 1000, 10000 ]:
+    emitter = Emitter()
+    receiver_objects = [ Receiver() for i in range(receivers) ]
+    def connectAll():
+      for receiver in receiver_objects:
+        connect(emitter, 'changed', receiver, 'onChanged')
+    def disconnectAll():
+      for receiver in receiver_objects:
+        disconnect(emitter, 'changed', receiver, 'onChanged')
+    connect_elapsed = disconnect_elapsed = float('inf')
+    for i in range(3):
+      connect_elapsed = min(connect_elapsed, best(connectAll, 1))
+      disconnect_elapsed = min(disconnect_elapsed, best(disconnectAll, 1))
+    results.add('connect', connect_elapsed / receivers * 1e6, 'us/op', listeners = receivers)
+    results.add('disconnect', disconnect_elapsed / receivers * 1e6, 'us/op', listeners = receivers)
+
+if __name__ == '__main__':
+  main(run)
@@ -0,0 +1,73 @@
+# Copyright 2024 Ole Kliemann
+# SPDX-License-Identifier: Apache-2.0
+
+import time
+import socket
+import asyncio
+import tempfile
+from mreventloop import Peer, Broker, BinaryCodec, JsonRpcCodec
+from harness import main
+
+def freeTcpPort():
+  with socket.socket() as s:
+    s.bind(('127.0.0.1', 0))
+    return s.getsockname()[1]
+
+def socketPaths(transport, directory):
+  if transport == 'inproc':
+    return f'inproc://{directory}/in', f'inproc://{directory}/out'
+  if transport == 'ipc':
+    return f'ipc://{directory}/in.sock', f'ipc://{directory}/out.sock'
+  else:
+    return f'tcp://127.0.0.1:{freeTcpPort()}', f'tcp://127.0.0.1:{freeTcpPort()}'
+
+async def measure(transport, proxy, codec, count, window_size = 500):
+  with tempfile.TemporaryDirectory() as directory:
+    in_socket_path, out_socket_path = socketPaths(transport, directory)
+    broker = Broker(in_socket_path, out_socket_path, proxy = proxy)
+    client = Peer(in_socket_path, out_socket_path, [ 'pong', 'received' ], [ 'ping', 'data' ], codec = codec())
+    server = Peer(in_socket_path, out_socket_path, [ 'ping', 'data' ], [ 'pong', 'received' ], codec = codec())
+
+    pongs = asyncio.Queue()
+    client.events.pong.addListener(pongs.put_nowait)
+    server.events.ping.addListener(server.publish.pong)
+    received = asyncio.Queue()
+    server.events.data.addListener(received.put_nowait)
+
+    async with broker, client, server:
+      await asyncio.sleep(0.1)
+      while pongs.empty():
+        client.publish.ping(-1)
+        await asyncio.sleep(0.01)
+      while not pongs.empty():
+        pongs.get_nowait()
+
+      rounds = max(count // 10, 10)
+      start = time.perf_counter()
+      for i in range(rounds):
+        client.publish.ping(i)
+        await pongs.get()
+      latency = (time.perf_counter() - start) / rounds
+
+      # PUB sockets drop beyond their high water mark, so events are sent in windows
+      start = time.perf_counter()
+      for window in range(0, count, window_size):
+        for i in range(window, min(window + window_size, count)):
+          client.publish.data(i)
+        for i in range(window, min(window + window_size, count)):
+          await asyncio.wait_for(received.get(), 10)
+      throughput = count / (time.perf_counter() - start)
+  return latency, throughput
+
+async def run(results, quick = False, counts = None):
+  for count in counts or [ 1000 if quick else 20000 ]:
+    for transport in [ 'inproc', 'ipc', 'tcp' ]:
+      for proxy in [ True, False ]:
+        for codec in [ JsonRpcCodec, BinaryCodec ]:
+          latency, throughput = await measure(transport, proxy, codec, count)
+          params = { 'messages': count, 'transport': transport, 'proxy': proxy, 'codec': codec.__name__ }
+          results.add('peer_round_trip', latency * 1e6, 'us', **params)
+          results.add('peer_throughput', throughput, 'events/s', **params)
+
+if __name__ == '__main__':
+  main(run)
@@ -0,0 +1,57 @@
+# Copyright 2024 Ole Kliemann
+# SPDX-License-Identifier: Apache-2.0
+
+import sys
+import json
+import time
+import asyncio
+import argparse
+import platform
+from importlib.metadata import version, PackageNotFoundError
+
+class Results:
+  def __init__(self, out = sys.stdout):
+    self.results = []
+    self.out = out
+
+  def add(self, benchmark, value, unit, **params):
+    self.results.append({ 'benchmark': benchmark, 'params': params, 'value': value, 'unit': unit })
+    params = ' '.join(f'{key}={value}' for key, value in params.items())
+    print(f'{benchmark:<28} {params:<32} {value:>16,.2f} {unit}', file = self.out, flush = True)
+
+  def toJson(self):
+    try:
+      package_version = version('MrEventLoop')
+    except PackageNotFoundError:
+      package_version = None
+    return {
+      'version': package_version,
+      'python': platform.python_version(),
+      'implementation': platform.python_implementation(),
+      'platform': platform.platform(),
+      'time': time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime()),
+      'results': self.results,
+    }
+
+def best(function, repeat = 5):
+  timings = []
+  for i in range(repeat):
+    start = time.perf_counter()
+    function()
+    timings.append(time.perf_counter() - start)
+  return min(timings)
+
+def main(*runs):
+  parser = argparse.ArgumentParser()
+  parser.add_argument('counts', nargs = '*', type = int, help = 'sizes to run with instead of the defaults')
+  parser.add_argument('--quick', action = 'store_true', help = 'run with small sizes')
+  parser.add_argument('--json', metavar = 'PATH', help = 'write results as JSON to PATH (- for stdout)')
+  args = parser.parse_args()
+  results = Results(sys.stderr if args.json == '-' else sys.stdout)
+  for run in runs:
+    asyncio.run(run(results, args.quick, args.counts or None))
+  if args.json == '-':
+    json.dump(results.toJson(), sys.stdout, indent = 2)
+  elif args.json:
+    with open(args.json, 'w') as f:
+      json.dump(results.toJson(), f, indent = 2)
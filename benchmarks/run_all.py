@@ -0,0 +1,10 @@
+# Copyright 2024 Ole Kliemann
+# SPDX-License-Identifier: Apache-2.0
+
+import bench_events
+import bench_event_loop
+import bench_peer
+from harness import main
+
+if __name__ == '__main__':
+  main(bench_events.run, bench_event_loop.run, bench_peer.run)
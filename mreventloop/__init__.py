@@ -3,7 +3,8 @@
 
 from mreventloop.events import Events
 from mreventloop.decorators import emits, slot, forwards
-from mreventloop.event_loop import EventLoop, has_event_loop
+from mreventloop.event_loop import EventLoop, EventLoopThread, has_event_loop
+from mreventloop.event_loop_group import EventLoopGroup
 from mreventloop.connect import connect, disconnect
 from mreventloop.spy import Spy
 from mreventloop.attr import setEventLoop, getEventLoop
@@ -11,6 +12,13 @@ from mreventloop.peer import Peer
 from mreventloop.broker import Broker
 from mreventloop.worker import Worker
 from mreventloop.sync_event import SyncEvent
+from mreventloop.codec import JsonRpcCodec, BinaryCodec, RawCodec
+from mreventloop.metrics import Metrics, PrometheusExporter
+from mreventloop.rpc import RpcError
+from mreventloop.journal import Journal
+from mreventloop.last_value_cache import LastValueCache
+from mreventloop.shared_sockets import SharedSockets
+from mreventloop.context import sharedContext
 
 __all__ = [
   'Events',
@@ -20,6 +28,7 @@ __all__ = [
   'forwards',
   'EventLoopThread',
   'EventLoopAsync',
+  'EventLoopGroup',
   'connect',
   'disconnect',
   'Spy',
@@ -29,4 +38,14 @@ __all__ = [
   'Broker',
   'Worker',
   'SyncEvent',
+  'JsonRpcCodec',
+  'BinaryCodec',
+  'RawCodec',
+  'Metrics',
+  'PrometheusExporter',
+  'RpcError',
+  'Journal',
+  'LastValueCache',
+  'SharedSockets',
+  'sharedContext',
 ]
@@ -4,6 +4,7 @@
 MREVENTLOOP_EVENTS_ATTR = '__mreventloop_events_attr__'
 MREVENTLOOP_EVENT_LOOP_ATTR = '__mreventloop_event_loop_attr__'
 MREVENTLOOP_NONE_ATTR = '__mreventloop_none_attr__'
+MREVENTLOOP_SLOT_ATTR = '__mreventloop_slot_attr__'
 
 def getEventsAttr(cls):
   return getattr(cls, MREVENTLOOP_EVENTS_ATTR, MREVENTLOOP_NONE_ATTR)
@@ -31,3 +32,9 @@ def getEventLoop(cls):
 
 def setEventLoop(cls, event_loop):
   setattr(cls, getEventLoopAttr(cls), event_loop)
+
+def getSlotInfo(function):
+  return getattr(function, MREVENTLOOP_SLOT_ATTR, None)
+
+def setSlotInfo(function, slot_info):
+  setattr(function, MREVENTLOOP_SLOT_ATTR, slot_info)
@@ -2,48 +2,154 @@
 # SPDX-License-Identifier: Apache-2.0
 
 import asyncio
+import struct
+import threading
 import zmq
-import zmq.asyncio
 from mreventloop.worker import Worker
+from mreventloop.context import sharedContext
+from mreventloop.rpc import RpcRouter
+from mreventloop.names import addTopicField
+from mreventloop.events import Events
+from mreventloop.flow_control import FlowControl, publishSocket, setSocketOptions
 import logging
 
 logger = logging.getLogger(__name__)
 
+_proxy_statistics_timeout = 1000
+
 class Broker(Worker):
-  def __init__(self, out_socket_path, in_socket_path):
-    super().__init__()
+  def __init__(
+    self,
+    out_socket_path,
+    in_socket_path,
+    proxy = True,
+    metrics = None,
+    name = None,
+    rpc_socket_path = None,
+    journal = None,
+    last_value_cache = None,
+    socket_options = None,
+    publish_overflow = None,
+    ctx = None
+  ):
+    super().__init__(metrics, name)
+    socket_options = socket_options or {}
 
     self.in_socket_path = in_socket_path
     self.out_socket_path = out_socket_path
 
-    self.ctx = zmq.asyncio.Context()
+    self.ctx = ctx or sharedContext()
     self.in_socket = self.ctx.socket(zmq.SUB)
-    self.out_socket = self.ctx.socket(zmq.PUB)
+    setSocketOptions(self.in_socket, socket_options.get('in'))
+    self.out_socket = publishSocket(
+      self.ctx,
+      publish_overflow,
+      socket_options.get('out'),
+      verbose = bool(last_value_cache)
+    )
+
+    self.events = Events([ 'blocked', 'unblocked', 'dropped' ])
+    self._flow_control = FlowControl(publish_overflow, self.events, metrics, self.name)
+
+    self.journal = journal
+    self.last_value_cache = last_value_cache
+    if last_value_cache:
+      last_value_cache.socket = self.out_socket
+    self.proxy = proxy and not journal and not last_value_cache and not publish_overflow
+    self._proxy_ctx = zmq.Context.shadow(self.ctx)
+    self._proxy_control_path = f'inproc://mreventloop-broker-proxy-{id(self)}'
+    self._proxy_control_in = None
+    self._proxy_control_out = None
+    self._proxy_control_lock = threading.Lock()
+    self._proxy_statistics = [ 0 ] * 8
+
+    self.rpc = RpcRouter(self.ctx, rpc_socket_path, journal) if rpc_socket_path else None
+    if self.rpc:
+      setSocketOptions(self.rpc.socket, socket_options.get('rpc'))
 
     self.in_socket_bound = asyncio.Event()
     self.out_socket_bound = asyncio.Event()
 
   async def _run(self):
-    try:
-      message = await asyncio.wait_for(self.in_socket.recv(), timeout = 0.1)
-    except asyncio.TimeoutError:
-      return
-    logger.debug(f'relaying message: {message}')
-    await self.out_socket.send(message)
+    if self.proxy:
+      await self._runProxy()
+    else:
+      await self._relay()
+
+  async def _relay(self):
+    frames = await self._receive(lambda: self.in_socket.recv_multipart(copy = False))
+    if logger.isEnabledFor(logging.DEBUG):
+      logger.debug('relaying message: %s', [ frame.bytes for frame in frames ])
+    if self.journal and len(frames) > 1:
+      topic = addTopicField(frames[0].bytes, b'J', self.journal.next_sequence)
+      frames = [ topic ] + [ frame.buffer for frame in frames[1:] ]
+      self.journal.append(frames)
+    sent = await self._flow_control.send(self.out_socket, frames)
+    if self.journal and not self.in_socket.getsockopt(zmq.EVENTS) & zmq.POLLIN:
+      # writes are batched while more events are waiting
+      self.journal.flush()
+    if self.last_value_cache:
+      self.last_value_cache.store(frames)
+    if self.metrics:
+      size = sum(len(frame) for frame in frames)
+      self._countMessages('in', 1, size)
+      if sent:
+        self._countMessages('out', 1, size)
+
+  async def _runProxy(self):
+    loop = asyncio.get_running_loop()
+    done = loop.create_future()
+    def proxy():
+      try:
+        zmq.proxy_steerable(
+          zmq.Socket.shadow(self.in_socket.underlying),
+          zmq.Socket.shadow(self.out_socket.underlying),
+          None,
+          self._proxy_control_in
+        )
+        loop.call_soon_threadsafe(done.set_result, None)
+      except Exception as e:
+        loop.call_soon_threadsafe(done.set_exception, e)
+    threading.Thread(target = proxy, daemon = True).start()
+    await done
+
+  def _collectProxyStatistics(self):
+    with self._proxy_control_lock:
+      control = self._proxy_control_out
+      if not control:
+        return
+      while control.poll(0):
+        # late reply to a request that timed out
+        control.recv_multipart()
+      try:
+        control.send(b'STATISTICS', zmq.NOBLOCK)
+      except zmq.Again:
+        logger.warning('proxy not accepting control commands')
+        return
+      if not control.poll(_proxy_statistics_timeout):
+        logger.warning('proxy did not report statistics')
+        return
+      frames = control.recv_multipart()
+    statistics = [ struct.unpack('=Q', frame)[0] for frame in frames ]
+    delta = [ new - old for new, old in zip(statistics, self._proxy_statistics) ]
+    self._proxy_statistics = statistics
+    self._countMessages('in', delta[0], delta[1])
+    self._countMessages('out', delta[6], delta[7])
 
   async def waitForBind(self, monitor, event):
     await monitor.recv()
     event.set()
 
+  def _monitor(self, socket, path, event):
+    # inproc sockets emit no monitor events, but bind immediately
+    if path.startswith('inproc://'):
+      event.set()
+    else:
+      asyncio.create_task(self.waitForBind(socket.get_monitor_socket(zmq.Event.LISTENING), event))
+
   async def __aenter__(self):
-    asyncio.create_task(self.waitForBind(
-      self.in_socket.get_monitor_socket(zmq.Event.LISTENING),
-      self.in_socket_bound
-    ))
-    asyncio.create_task(self.waitForBind(
-      self.out_socket.get_monitor_socket(zmq.Event.LISTENING),
-      self.out_socket_bound
-    ))
+    self._monitor(self.in_socket, self.in_socket_path, self.in_socket_bound)
+    self._monitor(self.out_socket, self.out_socket_path, self.out_socket_bound)
 
     self.in_socket.bind(self.in_socket_path)
     self.in_socket.setsockopt_string(zmq.SUBSCRIBE, '')
@@ -55,10 +161,39 @@ class Broker(Worker):
     self.in_socket.disable_monitor()
     self.out_socket.disable_monitor()
 
+    if self.proxy:
+      self._proxy_control_in = self._proxy_ctx.socket(zmq.PAIR)
+      self._proxy_control_in.bind(self._proxy_control_path)
+      self._proxy_control_out = self._proxy_ctx.socket(zmq.PAIR)
+      self._proxy_control_out.connect(self._proxy_control_path)
+      if self.metrics:
+        self.metrics.collector(self._collectProxyStatistics)
+
+    if self.rpc:
+      await self.rpc.__aenter__()
+    if self.last_value_cache:
+      await self.last_value_cache.__aenter__()
     await super().__aenter__()
     return self
 
   async def __aexit__(self, exc_type, exc_value, traceback):
+    if self.proxy:
+      if self.metrics:
+        self._collectProxyStatistics()
+      self.stop_event.set()
+      with self._proxy_control_lock:
+        self._proxy_control_out.send(b'TERMINATE')
     await super().__aexit__(exc_type, exc_value, traceback)
+    if self.rpc:
+      await self.rpc.__aexit__(exc_type, exc_value, traceback)
+    if self.last_value_cache:
+      await self.last_value_cache.__aexit__(exc_type, exc_value, traceback)
+    if self.proxy:
+      with self._proxy_control_lock:
+        self._proxy_control_in.close()
+        self._proxy_control_out.close()
+        self._proxy_control_out = None
     self.in_socket.close()
     self.out_socket.close()
+    if self.journal:
+      self.journal.close()
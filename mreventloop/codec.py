@@ -0,0 +1,143 @@
+# Copyright 2024 Ole Kliemann
+# SPDX-License-Identifier: Apache-2.0
+
+import json
+import struct
+from jsonrpcclient import request
+
+def decodeCall(codec, data):
+  event_name, args, *kwargs = codec.decode(data)
+  return event_name, args, kwargs[0] if kwargs else {}
+
+class JsonRpcCodec:
+  def encode(self, event_name, args):
+    return json.dumps(request(event_name, params = tuple(args))).encode()
+
+  def decode(self, data):
+    message = json.loads(bytes(data))
+    params = message.get('params', [])
+    if isinstance(params, dict):
+      return message['method'], [], params
+    return message['method'], list(params)
+
+_length = struct.Struct('<I')
+_int = struct.Struct('<q')
+_float = struct.Struct('<d')
+
+class BinaryCodec:
+  def encode(self, event_name, args):
+    parts = []
+    self._encode(event_name, parts)
+    self._encode(list(args), parts)
+    return b''.join(parts)
+
+  def decode(self, data):
+    view = memoryview(data)
+    try:
+      event_name, offset = self._decode(view, 0)
+      args, offset = self._decode(view, offset)
+    except (IndexError, struct.error):
+      raise ValueError('truncated data') from None
+    if offset != len(view):
+      raise ValueError(f'{len(view) - offset} trailing bytes')
+    return event_name, args
+
+  def _encode(self, value, parts):
+    if value is None:
+      parts.append(b'N')
+    elif value is True:
+      parts.append(b'T')
+    elif value is False:
+      parts.append(b'F')
+    elif isinstance(value, int):
+      if -2**63 <= value < 2**63:
+        parts.append(b'i')
+        parts.append(_int.pack(value))
+      else:
+        data = value.to_bytes((value.bit_length() + 8) // 8, 'little', signed = True)
+        parts.append(b'I')
+        parts.append(_length.pack(len(data)))
+        parts.append(data)
+    elif isinstance(value, float):
+      parts.append(b'd')
+      parts.append(_float.pack(value))
+    elif isinstance(value, str):
+      data = value.encode()
+      parts.append(b's')
+      parts.append(_length.pack(len(data)))
+      parts.append(data)
+    elif isinstance(value, (bytes, bytearray, memoryview)):
+      data = memoryview(value).cast('B')
+      parts.append(b'b')
+      parts.append(_length.pack(len(data)))
+      parts.append(data)
+    elif isinstance(value, (list, tuple)):
+      parts.append(b'l')
+      parts.append(_length.pack(len(value)))
+      for item in value:
+        self._encode(item, parts)
+    elif isinstance(value, dict):
+      parts.append(b'm')
+      parts.append(_length.pack(len(value)))
+      for key, item in value.items():
+        self._encode(key, parts)
+        self._encode(item, parts)
+    else:
+      raise TypeError(f'cannot encode {type(value).__name__}')
+
+  def _decode(self, view, offset):
+    tag = view[offset]
+    offset += 1
+    if tag == ord('N'):
+      return None, offset
+    elif tag == ord('T'):
+      return True, offset
+    elif tag == ord('F'):
+      return False, offset
+    elif tag == ord('i'):
+      return _int.unpack_from(view, offset)[0], offset + _int.size
+    elif tag == ord('d'):
+      return _float.unpack_from(view, offset)[0], offset + _float.size
+    elif tag in (ord('I'), ord('s'), ord('b')):
+      length = _length.unpack_from(view, offset)[0]
+      offset += _length.size
+      data = view[offset:offset + length]
+      if len(data) != length:
+        raise ValueError('truncated data')
+      if tag == ord('I'):
+        value = int.from_bytes(data, 'little', signed = True)
+      elif tag == ord('s'):
+        value = str(data, 'utf-8')
+      else:
+        value = bytes(data)
+      return value, offset + length
+    elif tag == ord('l'):
+      count = _length.unpack_from(view, offset)[0]
+      offset += _length.size
+      items = []
+      for i in range(count):
+        item, offset = self._decode(view, offset)
+        items.append(item)
+      return items, offset
+    elif tag == ord('m'):
+      count = _length.unpack_from(view, offset)[0]
+      offset += _length.size
+      items = {}
+      for i in range(count):
+        key, offset = self._decode(view, offset)
+        items[key], offset = self._decode(view, offset)
+      return items, offset
+    else:
+      raise ValueError(f'unknown tag {tag}')
+
+class RawCodec:
+  def encode(self, event_name, args):
+    assert len(args) == 1
+    name = event_name.encode()
+    return b''.join([ _length.pack(len(name)), name, memoryview(args[0]).cast('B') ])
+
+  def decode(self, data):
+    view = memoryview(data)
+    length = _length.unpack_from(view, 0)[0]
+    offset = _length.size + length
+    return str(view[_length.size:offset], 'utf-8'), [ bytes(view[offset:]) ]
@@ -4,24 +4,25 @@
 from mreventloop.attr import getEvents, getEvent
 from mreventloop.names import eventToSlotName
 from mreventloop.events import Events
+from mreventloop.decorators import makeListener
 
-def connect(*args, use_slot_names = True):
+def connect(*args, use_slot_names = True, weak = False):
   if len(args) == 2 and isinstance(args[0], Events) and callable(args[1]):
-    connectSingle(*args)
+    connectSingle(*args, weak = weak)
   elif len(args) == 4 and isinstance(args[1], str) and isinstance(args[3], str):
-    connectSingleByName(*args)
+    connectSingleByName(*args, weak = weak)
   elif len(args) == 3 and isinstance(args[1], str) and callable(args[2]):
-    connectSingleByNameFunction(*args)
+    connectSingleByNameFunction(*args, weak = weak)
   elif len(args) == 3 and isinstance(args[1], str) and not callable(args[2]):
-    connectSingleByNameBlind(*args)
+    connectSingleByNameBlind(*args, weak = weak)
   elif len(args) == 4 and isinstance(args[1], list) and isinstance(args[3], list):
-    connectList(*args)
+    connectList(*args, weak = weak)
   elif len(args) == 3 and isinstance(args[1], list):
-    connectListBlind(*args)
+    connectListBlind(*args, weak = weak)
   elif len(args) == 2 and not isinstance(args[0], Events) and not callable(args[1]) and use_slot_names:
-    connectAllSlotNames(*args)
+    connectAllSlotNames(*args, weak = weak)
   elif len(args) == 2 and not isinstance(args[0], Events) and not callable(args[1]) and not use_slot_names:
-    connectAllPlain(*args)
+    connectAllPlain(*args, weak = weak)
   else:
     assert False
 
@@ -49,59 +50,59 @@ def disconnect(*args, use_slot_names = True):
   else:
     assert False
 
-def connectSingle(event, slot):
-  event.addListener(slot)
+def connectSingle(event, slot, weak = False):
+  event.addListener(makeListener(slot), weak = weak)
 
 def disconnectSingle(event, slot):
   event.removeListener(slot)
 
-def connectSingleByName(emitter, event_name, receiver, slot_name):
-  connectSingle(getEvent(emitter, event_name), getattr(receiver, slot_name))
+def connectSingleByName(emitter, event_name, receiver, slot_name, weak = False):
+  connectSingle(getEvent(emitter, event_name), getattr(receiver, slot_name), weak = weak)
 
 def disconnectSingleByName(emitter, event_name, receiver, slot_name):
   disconnectSingle(getEvent(emitter, event_name), getattr(receiver, slot_name))
 
-def connectSingleByNameFunction(emitter, event_name, function):
-  connectSingle(getEvent(emitter, event_name), function)
+def connectSingleByNameFunction(emitter, event_name, function, weak = False):
+  connectSingle(getEvent(emitter, event_name), function, weak = weak)
 
 def disconnectSingleByNameFunction(emitter, event_name, function):
   disconnectSingle(getEvent(emitter, event_name), function)
 
-def connectSingleByNameBlind(emitter, event_name, receiver, ignore_missing_slot = False):
+def connectSingleByNameBlind(emitter, event_name, receiver, ignore_missing_slot = False, weak = False):
   if not ignore_missing_slot or hasattr(receiver, eventToSlotName(event_name)):
-    connectSingle(getEvent(emitter, event_name), getattr(receiver, eventToSlotName(event_name)))
+    connectSingle(getEvent(emitter, event_name), getattr(receiver, eventToSlotName(event_name)), weak = weak)
 
 def disconnectSingleByNameBlind(emitter, event_name, receiver, ignore_missing_slot = False):
   if not ignore_missing_slot or hasattr(receiver, eventToSlotName(event_name)):
     disconnectSingle(getEvent(emitter, event_name), getattr(receiver, eventToSlotName(event_name)))
 
-def connectList(emitter, event_names, receiver, slot_names):
+def connectList(emitter, event_names, receiver, slot_names, weak = False):
   for event_name, slot_name in zip(event_names, slot_names):
-    connectSingleByName(emitter, event_name, receiver, slot_name)
+    connectSingleByName(emitter, event_name, receiver, slot_name, weak = weak)
 
 def disconnectList(emitter, event_names, receiver, slot_names):
   for event_name, slot_name in zip(event_names, slot_names):
     disconnectSingleByName(emitter, event_name, receiver, slot_name)
 
-def connectListBlind(emitter, event_names, receiver):
+def connectListBlind(emitter, event_names, receiver, weak = False):
   for event_name in event_names:
-    connectSingleByNameBlind(emitter, event_name, receiver)
+    connectSingleByNameBlind(emitter, event_name, receiver, weak = weak)
 
 def disconnectListBlind(emitter, event_names, receiver):
   for event_name in event_names:
     disconnectSingleByNameBlind(emitter, event_name, receiver)
 
-def connectAllPlain(emitter, receiver):
+def connectAllPlain(emitter, receiver, weak = False):
   for event_name in getEvents(emitter).__event_names__:
-    connectSingleByName(emitter, event_name, receiver, event_name, ignore_missing_slot = True)
+    connectSingleByName(emitter, event_name, receiver, event_name, ignore_missing_slot = True, weak = weak)
 
 def disconnectAllPlain(emitter, receiver):
   for event_name in getEvents(emitter).__event_names__:
     disconnectSingleByName(emitter, event_name, receiver, event_name, ignore_missing_slot = True)
 
-def connectAllSlotNames(emitter, receiver):
+def connectAllSlotNames(emitter, receiver, weak = False):
   for event_name in getEvents(emitter).__event_names__:
-    connectSingleByNameBlind(emitter, event_name, receiver, ignore_missing_slot = True)
+    connectSingleByNameBlind(emitter, event_name, receiver, ignore_missing_slot = True, weak = weak)
 
 def disconnectAllSlotNames(emitter, receiver):
   for event_name in getEvents(emitter).__event_names__:
@@ -0,0 +1,17 @@
+# Copyright 2024 Ole Kliemann
+# SPDX-License-Identifier: Apache-2.0
+
+import zmq
+import zmq.asyncio
+import logging
+
+logger = logging.getLogger(__name__)
+
+def sharedContext(io_threads = None):
+  ctx = zmq.asyncio.Context.instance()
+  if io_threads is not None:
+    # only takes effect before the first socket is created
+    if ctx._sockets and ctx.get(zmq.IO_THREADS) != io_threads:
+      logger.warning('shared context already has sockets, io_threads = %s has no effect', io_threads)
+    ctx.set(zmq.IO_THREADS, io_threads)
+  return ctx
@@ -5,8 +5,11 @@ import asyncio
 import inspect
 from functools import partial
 from mreventloop.attr import getEvents, setEventsAttr, setEvents, setEventLoopAttr, getEvent, getEventLoop, setEventLoop
+from mreventloop.attr import getEventLoopAttr, getSlotInfo, setSlotInfo
 from mreventloop.names import slotToEventName
 from mreventloop.events import Events
+from mreventloop.slot_call import SlotCall
+from mreventloop.executor import ProcessSlot
 
 def emits(events_attr, event_names):
   def emits_(cls):
@@ -19,21 +22,108 @@ def emits(events_attr, event_names):
     return cls
   return emits_
 
-def slot(method):
+def slot(
+  method = None,
+  priority = 0,
+  executor = None,
+  coalesce = None,
+  debounce = None,
+  throttle = None
+):
+  if method is None:
+    return partial(
+      slot,
+      priority = priority,
+      executor = executor,
+      coalesce = coalesce,
+      debounce = debounce,
+      throttle = throttle
+    )
+  assert not (executor and inspect.iscoroutinefunction(method))
+  makeCall = slotCallFactory(method, priority, executor, coalesce, debounce, throttle)
+  if executor == 'process':
+    call = lambda self, *args, **kwargs: method(*args, **kwargs)
+  else:
+    call = method
   def wrapper(self, *args, **kwargs):
     event_loop = getEventLoop(self)
     if event_loop:
-      return event_loop.enqueue(method, self, *args, **kwargs)
+      return event_loop.enqueueCall(makeCall(self, args, kwargs))
     else:
-      return method(self, *args, **kwargs)
+      return call(self, *args, **kwargs)
+  setSlotInfo(wrapper, makeCall)
   return wrapper
 
+def slotCallFactory(method, priority, executor, coalesce, debounce, throttle):
+  if executor == 'process':
+    target = ProcessSlot(method)
+    def makeCall(receiver, args, kwargs):
+      return SlotCall(target, args, kwargs, priority, executor, receiver)
+  else:
+    def makeCall(receiver, args, kwargs):
+      return SlotCall(method, (receiver, *args), kwargs, priority, executor, receiver)
+
+  if debounce:
+    mode = ('debounce', debounce)
+  elif throttle:
+    mode = ('throttle', throttle)
+  elif coalesce:
+    mode = ('coalesce', None)
+  else:
+    return makeCall
+
+  key = coalesce if callable(coalesce) else None
+  def makeCoalescingCall(receiver, args, kwargs):
+    slot_call = makeCall(receiver, args, kwargs)
+    slot_call._coalesce = mode
+    slot_call._key = (method, id(receiver), key(*args, **kwargs) if key else None)
+    return slot_call
+  return makeCoalescingCall
+
+class SlotListener:
+  __slots__ = ('_slot', '_receiver', '_event_loop_attr', '_make_call')
+
+  def __init__(self, slot, make_call):
+    self._slot = slot
+    self._receiver = slot.__self__
+    self._event_loop_attr = getEventLoopAttr(self._receiver)
+    self._make_call = make_call
+
+  def __call__(self, *args, **kwargs):
+    event_loop = getattr(self._receiver, self._event_loop_attr, None)
+    if event_loop:
+      return event_loop.enqueueCall(self._make_call(self._receiver, args, kwargs))
+    else:
+      return self._slot(*args, **kwargs)
+
+  @property
+  def __self__(self):
+    return self._receiver
+
+  @property
+  def __func__(self):
+    return self._slot.__func__
+
+  def __eq__(self, other):
+    if isinstance(other, SlotListener):
+      other = other._slot
+    return self._slot == other
+
+  def __hash__(self):
+    return hash(self._slot)
+
+def makeListener(slot):
+  make_call = getSlotInfo(getattr(slot, '__func__', None))
+  if make_call is None:
+    return slot
+  return SlotListener(slot, make_call)
+
 def forwardSlot(self, event_name, *args, **kwargs):
   def wrapper(*args, **kwargs):
     event_loop = getEventLoop(self)
     event = getEvent(self, event_name)
     if event_loop:
-      event_loop.enqueue(event, *args, **kwargs)
+      event_loop.post(event, *args, **kwargs)
     else:
       event(*args, **kwargs)
   return wrapper
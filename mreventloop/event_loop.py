@@ -2,12 +2,20 @@
 # SPDX-License-Identifier: Apache-2.0
 
 import sys
+import time
 import asyncio
+import threading
+import concurrent.futures
+from collections import deque
 import logging
 import traceback
 from mreventloop.decorators import emits
 from mreventloop.attr import setEventLoopAttr, setEventLoop
 from mreventloop.slot_call import SlotCall
+from mreventloop.slot_queue import SlotQueue
+from mreventloop.executor import getDefaultExecutor
+from mreventloop.metrics import targetName
+from mreventloop.monitor import SlotMonitor
 
 logger = logging.getLogger(__name__)
 
@@ -18,32 +26,194 @@ def has_asyncio_event_loop():
   except RuntimeError:
     return False
 
-@emits('events', [ 'active', 'idle', 'exception', 'started', 'stopped' ])
+@emits('events', [ 'active', 'idle', 'exception', 'started', 'stopped', 'overflow', 'slow_slot' ])
 class EventLoop:
-  def __init__(self, exit_on_exception = True):
+  def __init__(
+    self,
+    exit_on_exception = True,
+    batch_size = 1,
+    batch_time = None,
+    maxsize = 0,
+    overflow = 'block',
+    coalesce_key = None,
+    starvation_limit = 100,
+    executors = None,
+    metrics = None,
+    name = None,
+    slow_slot_threshold = None,
+    sample_interval = None
+  ):
+    assert overflow in [ 'block', 'drop_newest', 'drop_oldest', 'coalesce' ]
     self.exit_on_exception = exit_on_exception
-    self.queue = asyncio.Queue()
+    self.batch_size = batch_size
+    self.batch_time = batch_time
+    self.overflow = overflow
+    self.coalesce_key = coalesce_key
+    self.executors = executors or {}
+    self.queue = SlotQueue(maxsize, starvation_limit)
     self.main = None
     self.closed = False
+    self._loop = None
+    self._thread_id = None
+    self._handoff = deque()
+    self._handoff_scheduled = False
+    self._debounced = {}
+    self._throttled = {}
+    self.name = name or f'{type(self).__name__}-{id(self):x}'
+    self.metrics = metrics
+    self._metric_labels = {}
+    if metrics:
+      metrics.gauge('mreventloop_queue_depth', (('loop', self.name),), lambda: len(self.queue))
+    if slow_slot_threshold or sample_interval:
+      self.monitor = SlotMonitor(slow_slot_threshold, sample_interval)
+    else:
+      self.monitor = None
 
   def enqueue(self, target, *args, **kwargs):
-    assert self.queue
-    assert has_asyncio_event_loop()
-    slot_call = SlotCall(target, args, kwargs)
+    return self.enqueueCall(SlotCall(target, args, kwargs))
+
+  def post(self, target, *args, **kwargs):
+    self.enqueueCall(SlotCall(target, args, kwargs))
+
+  async def waitForRoom(self):
+    await self.queue.waitForRoom()
+
+  def enqueueCall(self, slot_call):
+    if self._thread_id is None:
+      assert has_asyncio_event_loop()
+    elif threading.get_ident() != self._thread_id:
+      return self._enqueueThreadsafe(slot_call)
+    if slot_call._coalesce is not None:
+      return self._enqueueCoalescing(slot_call)
+    return self._admit(slot_call)
+
+  def _admit(self, slot_call):
+    if self.overflow == 'coalesce' and slot_call._key is None:
+      slot_call._key = self._coalesceKey(slot_call)
+    if self.metrics:
+      slot_call._enqueued = time.perf_counter()
+    if self.queue.full():
+      if self.metrics:
+        self.metrics.inc('mreventloop_overflows_total', (('loop', self.name), ('policy', self.overflow)))
+      self.events.overflow(self.overflow)
+      if self.overflow == 'block':
+        lower = self.queue.evict(slot_call._priority)
+        if lower is None:
+          self.queue.park(slot_call)
+          return slot_call
+        self.queue.park(lower, first = True)
+      elif self.overflow == 'drop_newest':
+        lower = self.queue.evict(slot_call._priority)
+        if lower is None:
+          slot_call._setResult(None)
+          return slot_call
+        self._drop(lower)
+      elif self.overflow == 'coalesce' and self.queue.find(slot_call._key):
+        return self._merge(self.queue.find(slot_call._key), slot_call)
+      else:
+        self._drop(self.queue.drop())
     self.queue.put_nowait(slot_call)
     return slot_call
 
+  def _coalesceKey(self, slot_call):
+    if self.coalesce_key:
+      return self.coalesce_key(slot_call._target, *slot_call._args, **slot_call._kwargs)
+    elif slot_call._receiver is not None:
+      return (slot_call._target, id(slot_call._receiver))
+    else:
+      return slot_call._target
+
+  def _enqueueCoalescing(self, slot_call):
+    mode, interval = slot_call._coalesce
+    key = slot_call._key
+    if mode == 'coalesce':
+      queued = self.queue.find(key)
+      return self._merge(queued, slot_call) if queued else self._admit(slot_call)
+    elif mode == 'debounce':
+      delayed = self._debounced.get(key)
+      if delayed:
+        delayed[0].cancel()
+        slot_call = self._merge(delayed[1], slot_call)
+      self._debounced[key] = [ self._callLater(interval, self._releaseDebounced, key), slot_call ]
+      return slot_call
+    else:
+      throttled = self._throttled.get(key)
+      if throttled is None:
+        self._throttled[key] = [ self._callLater(interval, self._releaseThrottled, key, interval), None ]
+        return self._admit(slot_call)
+      elif throttled[1]:
+        return self._merge(throttled[1], slot_call)
+      else:
+        throttled[1] = slot_call
+        return slot_call
+
+  def _releaseDebounced(self, key):
+    handle, slot_call = self._debounced.pop(key)
+    self._admit(slot_call)
+
+  def _releaseThrottled(self, key, interval):
+    handle, slot_call = self._throttled.pop(key)
+    if slot_call:
+      self._throttled[key] = [ self._callLater(interval, self._releaseThrottled, key, interval), None ]
+      self._admit(slot_call)
+
+  def _releaseAllDelayed(self):
+    delayed = list(self._debounced.values()) + list(self._throttled.values())
+    self._debounced = {}
+    self._throttled = {}
+    for handle, slot_call in delayed:
+      handle.cancel()
+      if slot_call:
+        self._admit(slot_call)
+
+  def _callLater(self, delay, callback, *args):
+    return (self._loop or asyncio.get_event_loop()).call_later(delay, callback, *args)
+
+  def _merge(self, queued, slot_call):
+    queued._args = slot_call._args
+    queued._kwargs = slot_call._kwargs
+    for callback in slot_call._callbacks or []:
+      queued._addCallback(callback)
+    return queued
+
+  def _enqueueThreadsafe(self, slot_call):
+    future = concurrent.futures.Future()
+    slot_call._addCallback(future.set_result)
+    self._handoff.append((slot_call, future))
+    if not self._handoff_scheduled:
+      self._handoff_scheduled = True
+      self._loop.call_soon_threadsafe(self._drainHandoff)
+    return future
+
+  def _drainHandoff(self):
+    self._handoff_scheduled = False
+    while self._handoff:
+      slot_call, future = self._handoff.popleft()
+      try:
+        self.enqueueCall(slot_call)
+      except asyncio.QueueFull as e:
+        future.set_exception(e)
+
+  def _drop(self, slot_call):
+    if slot_call != None:
+      slot_call._setResult(None)
+
   async def __aenter__(self):
+    self._loop = asyncio.get_running_loop()
+    self._thread_id = threading.get_ident()
     self.main = asyncio.create_task(self.run())
     return self
 
   async def __aexit__(self, exc_type, exc_value, traceback):
+    self._releaseAllDelayed()
     self.closed = True
     self.queue.put_nowait(None)
     if self.main and not self.main.done():
       await self.main
 
   async def run(self):
+    if self.monitor:
+      self.monitor.start(threading.get_ident())
     self.events.started()
     self.events.idle()
     while not (self.closed and self.queue.empty()):
@@ -51,17 +221,108 @@ class EventLoop:
       if slot_call == None:
         continue
       self.events.active()
-      try:
-        await slot_call._run()
-      except Exception as e:
-        logger.error(traceback.format_exc())
-        self.events.exception(e)
-        await slot_call._error()
-        if self.exit_on_exception:
-          sys.exit(1)
+      await self._runSlotCall(slot_call)
+      if self.batch_size != 1:
+        await self._runBatch()
       self.events.idle()
+    if self.monitor:
+      self.monitor.stop()
     self.events.stopped()
 
+  async def _runBatch(self):
+    count = 1
+    deadline = time.monotonic() + self.batch_time if self.batch_time else None
+    while not self.queue.empty():
+      if self.batch_size and count >= self.batch_size:
+        break
+      if deadline and time.monotonic() >= deadline:
+        break
+      slot_call = self.queue.get_nowait()
+      if slot_call == None:
+        continue
+      await self._runSlotCall(slot_call)
+      count += 1
+
+  def _getExecutor(self, executor):
+    if isinstance(executor, str):
+      return self.executors.get(executor) or getDefaultExecutor(executor)
+    return executor
+
+  def _slotLabels(self, target):
+    labels = self._metric_labels.get(target)
+    if labels is None:
+      labels = self._metric_labels[target] = (('loop', self.name), ('slot', targetName(target)))
+    return labels
+
+  async def _runSlotCall(self, slot_call):
+    if self.metrics:
+      labels = self._slotLabels(slot_call._target)
+      start = time.perf_counter()
+      if slot_call._enqueued is not None:
+        self.metrics.observe('mreventloop_slot_latency_seconds', labels, start - slot_call._enqueued)
+    if self.monitor:
+      self.monitor.begin(slot_call)
+    try:
+      if slot_call._executor:
+        await slot_call._run(self._getExecutor(slot_call._executor))
+      else:
+        await slot_call._run()
+    except Exception as e:
+      if self.metrics:
+        self.metrics.inc('mreventloop_slot_exceptions_total', labels)
+      logger.error(traceback.format_exc())
+      self.events.exception(e)
+      await slot_call._error(e)
+      if self.exit_on_exception:
+        sys.exit(1)
+    finally:
+      if self.monitor:
+        slow_slot = self.monitor.end()
+        if slow_slot:
+          self.events.slow_slot(*slow_slot)
+    if self.metrics:
+      self.metrics.inc('mreventloop_slot_calls_total', labels)
+      self.metrics.observe('mreventloop_slot_duration_seconds', labels, time.perf_counter() - start)
+
+class EventLoopThread(EventLoop):
+  def __init__(self, *args, **kwargs):
+    super().__init__(*args, **kwargs)
+    self.thread = None
+    self._running = threading.Event()
+
+  def start(self):
+    self.thread = threading.Thread(target = asyncio.run, args = (self._runThread(),), daemon = True)
+    self.thread.start()
+    self._running.wait()
+
+  def stop(self):
+    self._loop.call_soon_threadsafe(self._close)
+    self.thread.join()
+
+  async def _runThread(self):
+    await EventLoop.__aenter__(self)
+    self._running.set()
+    await self.main
+
+  def _close(self):
+    self._releaseAllDelayed()
+    self.closed = True
+    self.queue.put_nowait(None)
+
+  def __enter__(self):
+    self.start()
+    return self
+
+  def __exit__(self, exc_type, exc_value, traceback):
+    self.stop()
+
+  async def __aenter__(self):
+    self.start()
+    return self
+
+  async def __aexit__(self, exc_type, exc_value, traceback):
+    await asyncio.get_running_loop().run_in_executor(None, self.stop)
+
 def has_event_loop(event_loop_attr):
   def has_event_loop_(cls):
     setEventLoopAttr(cls, event_loop_attr)
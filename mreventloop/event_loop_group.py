@@ -0,0 +1,44 @@
+# Copyright 2024 Ole Kliemann
+# SPDX-License-Identifier: Apache-2.0
+
+import os
+import asyncio
+from mreventloop.event_loop import EventLoopThread
+from mreventloop.attr import setEventLoop
+
+class EventLoopGroup:
+  def __init__(self, size = None, **event_loop_args):
+    self.event_loops = [
+      EventLoopThread(**event_loop_args)
+      for i in range(size or os.cpu_count())
+    ]
+    self._next = 0
+
+  def pin(self, obj, shard = None):
+    if shard is None:
+      shard = self._next
+      self._next = (self._next + 1) % len(self.event_loops)
+    setEventLoop(obj, self.event_loops[shard])
+    return obj
+
+  def start(self):
+    for event_loop in self.event_loops:
+      event_loop.start()
+
+  def stop(self):
+    for event_loop in self.event_loops:
+      event_loop.stop()
+
+  def __enter__(self):
+    self.start()
+    return self
+
+  def __exit__(self, exc_type, exc_value, traceback):
+    self.stop()
+
+  async def __aenter__(self):
+    self.start()
+    return self
+
+  async def __aexit__(self, exc_type, exc_value, traceback):
+    await asyncio.get_running_loop().run_in_executor(None, self.stop)
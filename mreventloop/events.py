@@ -1,22 +1,106 @@
 # Copyright 2024 Ole Kliemann
 # SPDX-License-Identifier: Apache-2.0
 
+import weakref
+from collections import deque
+
+def listenerKey(slot):
+  receiver = getattr(slot, '__self__', None)
+  function = getattr(slot, '__func__', None)
+  if receiver is not None and function is not None:
+    return (id(receiver), function)
+  return slot
+
+class WeakListener:
+  __slots__ = ('_ref', '_function', '_event_loop_attr', '_make_call', '_hash')
+
+  def __init__(self, slot, on_dead):
+    receiver = getattr(slot, '__self__', None)
+    self._function = getattr(slot, '__func__', None)
+    if receiver is None or self._function is None:
+      raise TypeError('only bound methods can be connected weakly')
+    self._ref = weakref.ref(receiver, lambda ref: on_dead())
+    self._event_loop_attr = getattr(slot, '_event_loop_attr', None)
+    self._make_call = getattr(slot, '_make_call', None)
+    # equal to the bound method, so it has to hash like it
+    self._hash = hash(slot)
+
+  def __call__(self, *args, **kwargs):
+    receiver = self._ref()
+    if receiver is None:
+      return
+    if self._make_call is not None:
+      event_loop = getattr(receiver, self._event_loop_attr, None)
+      if event_loop:
+        return event_loop.enqueueCall(self._make_call(receiver, args, kwargs))
+    return self._function(receiver, *args, **kwargs)
+
+  @property
+  def __self__(self):
+    return self._ref()
+
+  @property
+  def __func__(self):
+    return self._function
+
+  def __eq__(self, other):
+    receiver = self._ref()
+    return (
+      receiver is not None
+      and getattr(other, '__self__', None) is receiver
+      and getattr(other, '__func__', None) is self._function
+    )
+
+  def __hash__(self):
+    return self._hash
+
 class Event:
   def __init__(self):
-    self.listeners = []
+    self._listeners = {}
+    self._entries = {}
+    self._next_entry = 0
+    self._dispatch = ()
+
+  @property
+  def listeners(self):
+    return list(self._listeners.values())
 
-  def addListener(self, slot):
+  def addListener(self, slot, weak = False):
     assert callable(slot)
-    self.listeners.append(slot)
+    key = listenerKey(slot)
+    self._next_entry += 1
+    entry = (key, self._next_entry)
+    if weak:
+      slot = WeakListener(slot, lambda: self._removeEntry(entry))
+    self._listeners[entry] = slot
+    self._entries.setdefault(key, deque()).append(entry)
+    self._dispatch = None
 
   def removeListener(self, slot):
-    self.listeners.remove(slot)
+    entries = self._entries.get(listenerKey(slot))
+    if not entries:
+      raise ValueError('listener not connected')
+    self._removeEntry(entries[0])
+
+  def _removeEntry(self, entry):
+    if self._listeners.pop(entry, None) is None:
+      return
+    entries = self._entries[entry[0]]
+    entries.remove(entry)
+    if not entries:
+      del self._entries[entry[0]]
+    self._dispatch = None
 
   def clearListeners(self):
-    self.listeners = []
+    self._listeners = {}
+    self._entries = {}
+    self._dispatch = ()
 
   def __call__(self, *args, **kwargs):
-    for slot in self.listeners:
+    dispatch = self._dispatch
+    if dispatch is None:
+      dispatch = self._dispatch = tuple(self._listeners.values())
+    for slot in dispatch:
       slot(*args, **kwargs)
 
 class Events:
@@ -0,0 +1,29 @@
+# Copyright 2024 Ole Kliemann
+# SPDX-License-Identifier: Apache-2.0
+
+import importlib
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+
+_default_executor_types = {
+  'thread': ThreadPoolExecutor,
+  'process': ProcessPoolExecutor,
+}
+_default_executors = {}
+_process_slots = {}
+
+def getDefaultExecutor(name):
+  if name not in _default_executors:
+    _default_executors[name] = _default_executor_types[name]()
+  return _default_executors[name]
+
+class ProcessSlot:
+  def __init__(self, method):
+    self.module = method.__module__
+    self.qualname = method.__qualname__
+    _process_slots[(self.module, self.qualname)] = method
+
+  def __call__(self, *args, **kwargs):
+    key = (self.module, self.qualname)
+    if key not in _process_slots:
+      importlib.import_module(self.module)
+    return _process_slots[key](*args, **kwargs)
@@ -0,0 +1,90 @@
+# Copyright 2024 Ole Kliemann
+# SPDX-License-Identifier: Apache-2.0
+
+import os
+import asyncio
+import time
+import zmq
+import logging
+
+logger = logging.getLogger(__name__)
+
+OVERFLOW_POLICIES = (None, 'drop', 'block')
+
+def setSocketOptions(socket, options):
+  for option, value in (options or {}).items():
+    socket.setsockopt(option, value)
+
+def publishSocket(ctx, overflow = None, options = None, verbose = False):
+  assert overflow in OVERFLOW_POLICIES
+  socket = ctx.socket(zmq.XPUB if overflow or verbose else zmq.PUB)
+  if verbose:
+    socket.setsockopt(zmq.XPUB_VERBOSE, 1)
+  if overflow:
+    socket.setsockopt(zmq.XPUB_NODROP, 1)
+  setSocketOptions(socket, options)
+  return socket
+
+class FlowControl:
+  def __init__(self, overflow, events, metrics = None, name = None, max_wait = 1):
+    assert overflow in OVERFLOW_POLICIES
+    self.overflow = overflow
+    self.events = events
+    self.metrics = metrics
+    self.name = name
+    self.max_wait = max_wait
+
+  async def send(self, socket, frames, count = 1):
+    if self.overflow is None:
+      await socket.send_multipart(frames, copy = False)
+      return True
+    try:
+      await socket.send_multipart(frames, flags = zmq.NOBLOCK, copy = False)
+      return True
+    except zmq.Again:
+      pass
+
+    event_name = bytes(frames[0]).split(b'\0', 1)[0].decode(errors = 'replace')
+    labels = (('worker', self.name), ('event', event_name))
+    if self.overflow == 'drop':
+      logger.debug('dropped %d %s', count, event_name)
+      if self.metrics:
+        self.metrics.inc('mreventloop_send_dropped_total', labels, count)
+      self.events.dropped(event_name, count)
+      return False
+
+    logger.debug('blocked on %s', event_name)
+    if self.metrics:
+      self.metrics.inc('mreventloop_send_blocked_total', labels)
+    self.events.blocked(event_name)
+    start = time.perf_counter()
+    await self._sendWhenWritable(socket, frames)
+    duration = time.perf_counter() - start
+    if self.metrics:
+      self.metrics.observe('mreventloop_send_blocked_seconds', labels, duration)
+    self.events.unblocked(event_name, duration)
+    return True
+
+  async def _sendWhenWritable(self, socket, frames):
+    # XPUB always reports POLLOUT, so wait for ZeroMQ to signal its socket's file descriptor
+    # instead, as it does once a full subscriber has taken messages.
+    # The descriptor is duplicated to not replace the reader pyzmq may have registered on it.
+    loop = asyncio.get_running_loop()
+    fd = os.dup(socket.getsockopt(zmq.FD))
+    signalled = asyncio.Event()
+    loop.add_reader(fd, signalled.set)
+    try:
+      while True:
+        signalled.clear()
+        try:
+          await socket.send_multipart(frames, flags = zmq.NOBLOCK, copy = False)
+          return
+        except zmq.Again:
+          pass
+        try:
+          await asyncio.wait_for(signalled.wait(), self.max_wait)
+        except asyncio.TimeoutError:
+          pass
+    finally:
+      loop.remove_reader(fd)
+      os.close(fd)
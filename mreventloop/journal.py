@@ -0,0 +1,193 @@
+# Copyright 2024 Ole Kliemann
+# SPDX-License-Identifier: Apache-2.0
+
+import os
+import mmap
+import struct
+import bisect
+import logging
+
+logger = logging.getLogger(__name__)
+
+_header = struct.Struct('<QI')
+_length = struct.Struct('<I')
+_index_interval = 64
+
+def encodeFrames(frames):
+  parts = [ _length.pack(len(frames)) ]
+  for frame in frames:
+    parts.append(_length.pack(len(frame)))
+    parts.append(frame)
+  return b''.join(parts)
+
+def decodeFrames(data):
+  view = memoryview(data)
+  count, = _length.unpack_from(view, 0)
+  offset = _length.size
+  frames = []
+  for i in range(count):
+    length, = _length.unpack_from(view, offset)
+    offset += _length.size
+    frames.append(view[offset:offset + length])
+    offset += length
+  return frames
+
+class Segment:
+  def __init__(self, path, first_sequence):
+    self.path = path
+    self.first_sequence = first_sequence
+    self._map = None
+    # every _index_interval-th record, for bisecting to a start offset
+    self._sequences = []
+    self._offsets = []
+
+  def view(self, size = 0):
+    # remaps only once the segment has grown past the current mapping
+    if self._map is None or len(self._map) < size:
+      self.close()
+      size = os.path.getsize(self.path)
+      if not size:
+        return memoryview(b'')
+      with open(self.path, 'rb') as f:
+        self._map = mmap.mmap(f.fileno(), size, access = mmap.ACCESS_READ)
+    return memoryview(self._map)
+
+  def offset(self, sequence):
+    i = bisect.bisect_right(self._sequences, sequence) - 1
+    return self._offsets[i] if i >= 0 else 0
+
+  def index(self, sequence, offset):
+    if not self._sequences or sequence >= self._sequences[-1] + _index_interval:
+      self._sequences.append(sequence)
+      self._offsets.append(offset)
+
+  def close(self):
+    if self._map is not None:
+      try:
+        self._map.close()
+      except BufferError:
+        pass
+      self._map = None
+
+class Journal:
+  def __init__(self, directory, segment_size = 64 * 1024 * 1024, max_segments = None, fsync = False):
+    self.directory = directory
+    self.segment_size = segment_size
+    self.max_segments = max_segments
+    self.fsync = fsync
+    os.makedirs(directory, exist_ok = True)
+    self._segments = [
+      Segment(os.path.join(directory, name), int(name.split('.')[0]))
+      for name in sorted(os.listdir(directory))
+      if name.endswith('.journal')
+    ]
+    self.next_sequence = 1
+    if self._segments:
+      self._recover()
+    self._file = None
+    self._size = 0
+    self._unflushed = False
+
+  @property
+  def first_sequence(self):
+    return self._segments[0].first_sequence if self._segments else self.next_sequence
+
+  def append(self, frames):
+    if self._file is None or self._size >= self.segment_size:
+      self._openSegment()
+    sequence = self.next_sequence
+    body = encodeFrames(frames)
+    self._segments[-1].index(sequence, self._size)
+    self._file.write(_header.pack(sequence, len(body)))
+    self._file.write(body)
+    self._unflushed = True
+    if self.fsync:
+      self.flush()
+    self._size += _header.size + len(body)
+    self.next_sequence += 1
+    return sequence
+
+  def flush(self):
+    if self._unflushed:
+      self._file.flush()
+      if self.fsync:
+        os.fsync(self._file.fileno())
+      self._unflushed = False
+
+  def read(self, sequence):
+    self.flush()
+    for i, segment in enumerate(self._segments):
+      if i + 1 < len(self._segments) and self._segments[i + 1].first_sequence <= sequence:
+        continue
+      size = self._size if i + 1 == len(self._segments) and self._file else self._fileSize(segment)
+      yield from self._scan(segment, sequence, size)
+
+  def _recover(self):
+    # segments are named after their first sequence number, even if the broker stopped before writing to them
+    self.next_sequence = self._segments[-1].first_sequence
+    for segment in reversed(self._segments):
+      last_sequence, end = self._lastRecord(segment)
+      size = self._fileSize(segment)
+      segment.close()
+      if segment is self._segments[-1] and end < size:
+        logger.warning('dropping truncated record at the end of %s', segment.path)
+        os.truncate(segment.path, end)
+      if last_sequence is not None:
+        self.next_sequence = max(self.next_sequence, last_sequence + 1)
+        return
+
+  def _lastRecord(self, segment):
+    size = self._fileSize(segment)
+    view = segment.view(size)
+    last_sequence, offset = None, 0
+    while offset + _header.size <= size:
+      sequence, length = _header.unpack_from(view, offset)
+      if offset + _header.size + length > size:
+        break
+      last_sequence = sequence
+      offset += _header.size + length
+    return last_sequence, offset
+
+  def _fileSize(self, segment):
+    return os.path.getsize(segment.path)
+
+  def _scan(self, segment, sequence, size):
+    view = segment.view()
+    offset = segment.offset(sequence)
+    while offset + _header.size <= size:
+      if offset + _header.size > len(view):
+        view = segment.view(size)
+      record_sequence, length = _header.unpack_from(view, offset)
+      end = offset + _header.size + length
+      if end > len(view) and end <= size:
+        view = segment.view(size)
+      if end > min(len(view), size):
+        logger.warning('truncated record in %s', segment.path)
+        return
+      segment.index(record_sequence, offset)
+      offset += _header.size
+      if record_sequence >= sequence:
+        yield record_sequence, view[offset:offset + length]
+      offset += length
+
+  def _openSegment(self):
+    if self._file is not None:
+      self.flush()
+      self._file.close()
+    path = os.path.join(self.directory, f'{self.next_sequence:020d}.journal')
+    if not self._segments or self._segments[-1].path != path:
+      self._segments.append(Segment(path, self.next_sequence))
+    self._file = open(path, 'ab')
+    self._size = self._file.tell()
+    while self.max_segments and len(self._segments) > self.max_segments:
+      segment = self._segments.pop(0)
+      segment.close()
+      os.remove(segment.path)
+
+  def close(self):
+    if self._file is not None:
+      self.flush()
+      self._file.close()
+      self._file = None
+    for segment in self._segments:
+      segment.close()
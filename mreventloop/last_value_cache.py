@@ -0,0 +1,70 @@
+# Copyright 2024 Ole Kliemann
+# SPDX-License-Identifier: Apache-2.0
+
+import zmq
+from collections import OrderedDict
+from mreventloop.worker import Worker
+from mreventloop.names import addTopicField
+from mreventloop.codec import decodeCall
+import logging
+
+logger = logging.getLogger(__name__)
+
+class LastValueCache(Worker):
+  def __init__(self, codec = None, max_topics = 10000, max_keys = 1000):
+    super().__init__()
+    self.codec = codec
+    self.max_topics = max_topics
+    self.max_keys = max_keys
+    self.socket = None
+    self._topics = OrderedDict()
+
+  def store(self, frames):
+    if len(frames) < 2:
+      return
+    topic = bytes(frames[0])
+    base_topic = topic[:topic.index(b'\0') + 1]
+    values = self._topics.get(base_topic)
+    if values is None:
+      values = self._topics[base_topic] = OrderedDict()
+      if len(self._topics) > self.max_topics:
+        self._topics.popitem(last = False)
+    else:
+      self._topics.move_to_end(base_topic)
+
+    # marked, so that peers do not take cached values for new ones in sequencing
+    topic = addTopicField(topic, b'C', 1)
+    if self.codec is None:
+      values[None] = [ topic ] + [ bytes(frame) for frame in frames[1:] ]
+      return
+    for frame in frames[1:]:
+      payload = bytes(frame)
+      try:
+        event_name, args, kwargs = decodeCall(self.codec, payload)
+      except Exception:
+        logger.warning('not caching undecodable message')
+        continue
+      key = args[0] if args else next(iter(kwargs.values()), None)
+      try:
+        hash(key)
+      except TypeError:
+        key = repr(key)
+      values[key] = [ topic, payload ]
+      values.move_to_end(key)
+      if len(values) > self.max_keys:
+        values.popitem(last = False)
+
+  async def _run(self):
+    message = await self._receive(lambda: self.socket.recv())
+    if not message or message[0] != 1:
+      return
+    prefix = message[1:]
+    for base_topic, values in list(self._topics.items()):
+      if base_topic.startswith(prefix):
+        for frames in list(values.values()):
+          try:
+            await self.socket.send_multipart(frames, flags = zmq.NOBLOCK)
+          except zmq.Again:
+            logger.warning('subscriber not keeping up, not serving last values for %s', prefix)
+            return
+    logger.debug('served last values for %s', prefix)
@@ -0,0 +1,151 @@
+# Copyright 2024 Ole Kliemann
+# SPDX-License-Identifier: Apache-2.0
+
+import asyncio
+import threading
+from bisect import bisect_left
+import logging
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_BUCKETS = (
+  0.00001, 0.00005, 0.0001, 0.0005, 0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1.0, 5.0
+)
+
+def targetName(target):
+  return getattr(target, '__qualname__', None) or type(target).__qualname__
+
+class Histogram:
+  def __init__(self, buckets = DEFAULT_BUCKETS):
+    self.buckets = buckets
+    self.counts = [ 0 ] * (len(buckets) + 1)
+    self.count = 0
+    self.sum = 0.0
+
+  def observe(self, value):
+    self.counts[bisect_left(self.buckets, value)] += 1
+    self.count += 1
+    self.sum += value
+
+  def snapshot(self):
+    buckets = {}
+    cumulative = 0
+    for bound, count in zip(self.buckets + (float('inf'),), self.counts):
+      cumulative += count
+      buckets[bound] = cumulative
+    return { 'count': self.count, 'sum': self.sum, 'buckets': buckets }
+
+class Metrics:
+  def __init__(self, buckets = DEFAULT_BUCKETS):
+    self.buckets = buckets
+    self._counters = {}
+    self._gauges = {}
+    self._histograms = {}
+    self._collectors = []
+    self._lock = threading.Lock()
+
+  def inc(self, name, labels = (), value = 1):
+    key = (name, labels)
+    with self._lock:
+      self._counters[key] = self._counters.get(key, 0) + value
+
+  def observe(self, name, labels, value):
+    with self._lock:
+      histogram = self._histograms.get((name, labels))
+      if histogram is None:
+        histogram = self._histograms[(name, labels)] = Histogram(self.buckets)
+      histogram.observe(value)
+
+  def gauge(self, name, labels, function):
+    with self._lock:
+      self._gauges[(name, labels)] = function
+
+  def collector(self, function):
+    with self._lock:
+      self._collectors.append(function)
+
+  def snapshot(self):
+    with self._lock:
+      collectors = list(self._collectors)
+    for collector in collectors:
+      try:
+        collector()
+      except Exception:
+        logger.warning('metrics collector failed', exc_info = True)
+    snapshot = {}
+    with self._lock:
+      for (name, labels), value in self._counters.items():
+        snapshot.setdefault(name, {})[labels] = value
+      gauges = list(self._gauges.items())
+      for (name, labels), histogram in self._histograms.items():
+        snapshot.setdefault(name, {})[labels] = histogram.snapshot()
+    for (name, labels), function in gauges:
+      snapshot.setdefault(name, {})[labels] = function()
+    return snapshot
+
+  def toPrometheus(self):
+    snapshot = self.snapshot()
+    types = {}
+    with self._lock:
+      for name, labels in self._counters:
+        types[name] = 'counter'
+      for name, labels in self._gauges:
+        types[name] = 'gauge'
+      for name, labels in self._histograms:
+        types[name] = 'histogram'
+    lines = []
+    for name, series in sorted(snapshot.items()):
+      lines.append(f'# TYPE {name} {types[name]}')
+      for labels, value in series.items():
+        if types[name] != 'histogram':
+          lines.append(f'{name}{formatLabels(labels)} {value}')
+          continue
+        for bound, count in value['buckets'].items():
+          le = '+Inf' if bound == float('inf') else repr(bound)
+          lines.append(f'{name}_bucket{formatLabels(labels + (("le", le),))} {count}')
+        lines.append(f'{name}_sum{formatLabels(labels)} {value["sum"]}')
+        lines.append(f'{name}_count{formatLabels(labels)} {value["count"]}')
+    return '\n'.join(lines) + '\n'
+
+def formatLabels(labels):
+  if not labels:
+    return ''
+  escaped = (
+    (key, str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n'))
+    for key, value in labels
+  )
+  return '{' + ','.join(f'{key}="{value}"' for key, value in escaped) + '}'
+
+class PrometheusExporter:
+  def __init__(self, metrics, host = '127.0.0.1', port = 9464):
+    self.metrics = metrics
+    self.host = host
+    self.port = port
+    self.server = None
+
+  async def _handle(self, reader, writer):
+    try:
+      while (await reader.readline()).strip():
+        pass
+      body = self.metrics.toPrometheus().encode()
+      writer.write(
+        b'HTTP/1.0 200 OK\r\n'
+        b'Content-Type: text/plain; version=0.0.4\r\n'
+        + f'Content-Length: {len(body)}\r\n\r\n'.encode()
+        + body
+      )
+      await writer.drain()
+    except ConnectionError:
+      pass
+    finally:
+      writer.close()
+
+  async def __aenter__(self):
+    self.server = await asyncio.start_server(self._handle, self.host, self.port)
+    self.port = self.server.sockets[0].getsockname()[1]
+    logger.debug('exporting metrics on %s:%d', self.host, self.port)
+    return self
+
+  async def __aexit__(self, exc_type, exc_value, traceback):
+    self.server.close()
+    await self.server.wait_closed()
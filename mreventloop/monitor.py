@@ -0,0 +1,117 @@
+# Copyright 2024 Ole Kliemann
+# SPDX-License-Identifier: Apache-2.0
+
+import sys
+import time
+import reprlib
+import threading
+import traceback
+from collections import Counter
+from mreventloop.slot_call import SlotCall
+from mreventloop.metrics import targetName
+import logging
+
+logger = logging.getLogger(__name__)
+
+def codeName(code):
+  return getattr(code, 'co_qualname', code.co_name)
+
+def slotFrames(slot_call, frame):
+  # frames above the slot call's own _run, or None if it is not on the stack,
+  # e.g. while awaiting, or when another event loop on the thread runs a slot
+  frames = []
+  while frame is not None:
+    if frame.f_code is SlotCall._run.__code__:
+      return frames[::-1] if frame.f_locals.get('self') is slot_call else None
+    frames.append(frame)
+    frame = frame.f_back
+  return None
+
+def foldStack(slot_call, frame):
+  frames = slotFrames(slot_call, frame)
+  if not frames:
+    return targetName(slot_call._target)
+  return ';'.join(codeName(frame.f_code) for frame in frames)
+
+class SlotMonitor:
+  def __init__(self, slow_slot_threshold = None, sample_interval = None):
+    assert slow_slot_threshold or sample_interval
+    self.slow_slot_threshold = slow_slot_threshold
+    self.sample_interval = sample_interval
+    self.samples = Counter()
+    self._samples_lock = threading.Lock()
+    self._check_interval = slow_slot_threshold and slow_slot_threshold / 4
+    self._thread_id = None
+    self._thread = None
+    self._stop = threading.Event()
+    self._current = None
+    self._slow = None
+
+  def start(self, thread_id):
+    self._thread_id = thread_id
+    self._stop.clear()
+    self._thread = threading.Thread(target = self._watch, daemon = True)
+    self._thread.start()
+
+  def stop(self):
+    self._stop.set()
+    self._thread.join()
+
+  def begin(self, slot_call):
+    self._current = (slot_call, time.perf_counter())
+
+  def end(self):
+    current = self._current
+    self._current = None
+    slot_call, start = current
+    duration = time.perf_counter() - start
+    if not self.slow_slot_threshold or duration < self.slow_slot_threshold:
+      return None
+    slow = self._slow
+    stack = slow[1] if slow and slow[0] is current else None
+    return (targetName(slot_call._target), reprlib.repr(slot_call._args), stack, duration)
+
+  def folded(self):
+    with self._samples_lock:
+      samples = list(self.samples.items())
+    return ''.join(f'{stack} {count}\n' for stack, count in samples)
+
+  def _watch(self):
+    # sampling and checking for slow slots keep their own schedules
+    now = time.perf_counter()
+    next_sample = now + self.sample_interval if self.sample_interval else None
+    next_check = now + self._check_interval if self._check_interval else None
+    while not self._stop.wait(max(0, min(filter(None, [ next_sample, next_check ])) - time.perf_counter())):
+      now = time.perf_counter()
+      sample = next_sample is not None and now >= next_sample
+      if sample:
+        next_sample += self.sample_interval
+        if next_sample <= now:
+          next_sample = now + self.sample_interval
+      check = next_check is not None and now >= next_check
+      if check:
+        next_check += self._check_interval
+        if next_check <= now:
+          next_check = now + self._check_interval
+      current = self._current
+      if current is None:
+        continue
+      slot_call, start = current
+      frame = sys._current_frames().get(self._thread_id)
+      if sample:
+        stack = foldStack(slot_call, frame)
+        with self._samples_lock:
+          self.samples[stack] += 1
+      if (
+        check
+        and now - start >= self.slow_slot_threshold
+        and (self._slow is None or self._slow[0] is not current or self._slow[1] is None)
+      ):
+        if self._slow is None or self._slow[0] is not current:
+          logger.warning(
+            'slot %s running for more than %ss',
+            targetName(slot_call._target),
+            self.slow_slot_threshold
+          )
+        stack = traceback.format_stack(frame) if slotFrames(slot_call, frame) else None
+        self._slow = (current, stack)
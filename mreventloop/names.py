@@ -14,3 +14,20 @@ def slotToEventName(slot_name):
 def eventToRequestName(event_name):
   segments = event_name.split('_')
   return ''.join([segments[0]] + [segment.capitalize() for segment in segments[1:]])
+
+def eventToTopic(event_name):
+  return event_name.encode() + b'\0'
+
+def topicToEventName(topic):
+  return topic[:topic.index(b'\0')].decode()
+
+def addTopicField(topic, tag, value):
+  return topic + tag + value.to_bytes(8, 'big')
+
+def topicFields(topic):
+  fields = {}
+  offset = topic.index(b'\0') + 1
+  while offset < len(topic):
+    fields[topic[offset:offset + 1]] = int.from_bytes(topic[offset + 1:offset + 9], 'big')
+    offset += 9
+  return fields
@@ -1,89 +1,435 @@
 # Copyright 2024 Ole Kliemann
 # SPDX-License-Identifier: Apache-2.0
 
+import os
 import asyncio
+import struct
 import zmq
-import zmq.asyncio
-import json
 import traceback
 from types import SimpleNamespace
-from jsonrpcserver import Success, dispatch
-from jsonrpcclient import request
+from mreventloop.codec import JsonRpcCodec, decodeCall
+from mreventloop.names import eventToTopic, addTopicField, topicFields
+from mreventloop.journal import decodeFrames
 from mreventloop.decorators import emits, slot
 from mreventloop.event_loop import has_event_loop
 from mreventloop.attr import setEvents
 from mreventloop.events import Events
+from mreventloop.connect import connect
 from mreventloop.worker import Worker
+from mreventloop.rpc import RpcEndpoint, RpcCalls
+from mreventloop.sequencing import Stream, RetransmitBuffer
+from mreventloop.flow_control import FlowControl, publishSocket, setSocketOptions
+from mreventloop.context import sharedContext
 import logging
 
 logger = logging.getLogger(__name__)
 
+_sequence = struct.Struct('!Q')
+
+def retransmitMethod(publisher_id):
+  return f'retransmit-{publisher_id:016x}'
+
 @emits('events', [])
 @has_event_loop('event_loop')
 class Peer(Worker):
-  def __init__(self, in_socket_path, out_socket_path, sub_event_names, pub_event_names):
-    super().__init__()
+  def __init__(
+    self,
+    in_socket_path,
+    out_socket_path,
+    sub_event_names,
+    pub_event_names,
+    codec = None,
+    publish_batch_size = 1,
+    publish_batch_time = None,
+    metrics = None,
+    name = None,
+    rpc_socket_path = None,
+    rpc_timeout = 10,
+    direct_socket_path = None,
+    direct_event_names = None,
+    replay_from = None,
+    sequenced = False,
+    retransmit_buffer = 0,
+    recovery_timeout = 1,
+    heartbeat_interval = None,
+    socket_options = None,
+    publish_overflow = None,
+    ctx = None,
+    shared_sockets = None
+  ):
+    super().__init__(metrics, name)
+    socket_options = socket_options or {}
 
     self._in_socket_path = in_socket_path
     self._out_socket_path = out_socket_path
-    self._ctx = zmq.asyncio.Context()
-    self._in_socket = self._ctx.socket(zmq.SUB)
-    self._out_socket = self._ctx.socket(zmq.PUB)
+    self._ctx = ctx or sharedContext()
+    self._shared_sockets = shared_sockets
+    if shared_sockets:
+      if (in_socket_path, out_socket_path) != (shared_sockets.in_socket_path, shared_sockets.out_socket_path):
+        raise ValueError('shared sockets connect to other paths')
+      if 'in' in socket_options or 'out' in socket_options:
+        raise ValueError('socket options for shared sockets are given to SharedSockets')
+      if publish_overflow not in (None, shared_sockets.publish_overflow):
+        raise ValueError('publish_overflow for shared sockets is given to SharedSockets')
+      publish_overflow = shared_sockets.publish_overflow
+      self._in_socket = shared_sockets.in_socket
+      self._out_socket = shared_sockets.out_socket
+      self._inbox = asyncio.Queue(shared_sockets.inbox_size)
+      self._recv = self._inbox.get
+    else:
+      self._in_socket = self._ctx.socket(zmq.SUB)
+      setSocketOptions(self._in_socket, socket_options.get('in'))
+      self._out_socket = publishSocket(self._ctx, publish_overflow, socket_options.get('out'))
+      self._recv = lambda: self._in_socket.recv_multipart(copy = False)
 
     self._in_socket_connected = asyncio.Event()
     self._out_socket_connected = asyncio.Event()
 
     self.events = Events(sub_event_names)
+    self.peer_events = Events([ 'gap', 'blocked', 'unblocked', 'dropped' ])
+    self._flow_control = FlowControl(publish_overflow, self.peer_events, metrics, self.name)
+    if metrics:
+      metrics.gauge('mreventloop_queue_depth', (('loop', self.name),), lambda: len(self.event_loop.queue))
 
-    self._methods = {
-      event_name: lambda *args, event_name=event_name, **kwargs: \
-        Success(getattr(self.events, event_name)(*args, **kwargs))
+    self.codec = codec or JsonRpcCodec()
+    self._sub_events = {
+      event_name: getattr(self.events, event_name)
       for event_name in sub_event_names
     }
 
+    if rpc_socket_path:
+      self.rpc = RpcEndpoint(self._ctx, rpc_socket_path, self.codec, rpc_timeout)
+      setSocketOptions(self.rpc.socket, socket_options.get('rpc'))
+      self.call = RpcCalls(self.rpc)
+      connect(self.rpc, 'announced', self._connectDirect)
+      connect(self.rpc, 'withdrawn', self._disconnectDirect)
+    else:
+      self.rpc = None
+
+    if direct_event_names and not (rpc_socket_path and direct_socket_path):
+      raise ValueError('direct events require rpc_socket_path and direct_socket_path')
+    self._direct_socket_path = direct_socket_path
+    self._direct_event_names = list(direct_event_names or [])
+    self._direct_socket = (
+      publishSocket(self._ctx, publish_overflow, socket_options.get('direct'))
+      if self._direct_event_names else None
+    )
+    self._direct_paths = {}
+    self._pub_sockets = {
+      event_name: self._direct_socket if event_name in self._direct_event_names else self._out_socket
+      for event_name in pub_event_names
+    }
+
+    if replay_from is not None and not rpc_socket_path:
+      raise ValueError('replay_from requires rpc_socket_path')
+    self.replay_from = replay_from
+    self.sequence = 0
+    self._replay_buffer = None
+
+    if retransmit_buffer and not (sequenced and rpc_socket_path):
+      raise ValueError('retransmit_buffer requires sequenced and rpc_socket_path')
+    self.sequenced = sequenced
+    self.publisher_id = int.from_bytes(os.urandom(8), 'big')
+    self._sequences = {}
+    self._streams = {}
+    self._recovering = set()
+    self.recovery_timeout = recovery_timeout
+    if heartbeat_interval and not sequenced:
+      raise ValueError('heartbeat_interval requires sequenced')
+    self.heartbeat_interval = heartbeat_interval
+    self._heartbeat_timer = None
+    if retransmit_buffer:
+      self._retransmit_buffer = RetransmitBuffer(retransmit_buffer)
+      self.rpc.serve(retransmitMethod(self.publisher_id), self._retransmit, raw = True)
+    else:
+      self._retransmit_buffer = None
+
+    self.publish_batch_size = publish_batch_size
+    self.publish_batch_time = publish_batch_time
+    self._pending = []
+    self._flush_call = None
+    self._flush_timer = None
+
+    publish = self._publish if publish_batch_size == 1 else self._publishBatched
     self.publish = SimpleNamespace()
     for event_name in pub_event_names:
       setattr(
         self.publish,
         event_name,
         lambda *args, event_name=event_name: \
-          self._publish(event_name, *args)
+          publish(event_name, *args)
       )
 
+  def serve(self, method, function):
+    self.rpc.serve(method, function)
+
   @slot
   async def _publish(self, event_name, *args):
-    message = request(event_name, params = tuple(args))
-    await self._out_socket.send_string(json.dumps(message))
-    logger.debug(f'published: {message}')
+    message = self.codec.encode(event_name, args)
+    frames = [ self._topic(event_name, [ message ]), message ]
+    if not await self._flow_control.send(self._pub_sockets[event_name], frames):
+      return
+    if self.metrics:
+      self._countMessages('out', 1, len(message))
+    logger.debug('published: %s %s', event_name, args)
+
+  def _publishBatched(self, event_name, *args):
+    self._pending.append((event_name, args))
+    if not self._flush_call:
+      if self.publish_batch_time:
+        loop = asyncio.get_running_loop()
+        self._flush_call = loop.create_future()
+        self._flush_timer = loop.call_later(self.publish_batch_time, self._flushLater)
+      else:
+        self._flush_call = self._flush()
+    return self._flush_call
+
+  def _flushLater(self):
+    self._flush_timer = None
+    flushed = self._flush_call
+    self._flush()._addCallback(lambda result: flushed.done() or flushed.set_result(result))
+
+  @slot
+  async def _flush(self):
+    pending = self._pending
+    self._pending = []
+    self._flush_call = None
+
+    batch_event_name = None
+    batch = []
+    for event_name, args in pending:
+      if event_name != batch_event_name or len(batch) == self.publish_batch_size:
+        if batch:
+          await self._sendBatch(batch_event_name, batch)
+        batch_event_name = event_name
+        batch = []
+      batch.append(self.codec.encode(event_name, args))
+    if batch:
+      await self._sendBatch(batch_event_name, batch)
+    logger.debug('published batch of %d', len(pending))
+
+  async def _sendBatch(self, event_name, batch):
+    frames = [ self._topic(event_name, batch) ] + batch
+    if not await self._flow_control.send(self._pub_sockets[event_name], frames, len(batch)):
+      return
+    if self.metrics:
+      self._countMessages('out', len(batch), sum(len(message) for message in batch))
+
+  def _topic(self, event_name, payloads):
+    topic = eventToTopic(event_name)
+    if not self.sequenced:
+      return topic
+    sequence = self._sequences.get(event_name, 1)
+    self._sequences[event_name] = sequence + len(payloads)
+    if self._retransmit_buffer:
+      self._retransmit_buffer.append(event_name, sequence, payloads)
+    return addTopicField(addTopicField(topic, b'P', self.publisher_id), b'S', sequence)
+
+  def _heartbeatLater(self):
+    self._sendHeartbeat()
+    self._heartbeat_timer = asyncio.get_running_loop().call_later(self.heartbeat_interval, self._heartbeatLater)
+
+  @slot
+  async def _sendHeartbeat(self):
+    # the next sequence number without events, so that lost last events show as a gap
+    for event_name, sequence in list(self._sequences.items()):
+      topic = addTopicField(addTopicField(eventToTopic(event_name), b'P', self.publisher_id), b'S', sequence)
+      try:
+        await self._pub_sockets[event_name].send_multipart([ topic ], flags = zmq.NOBLOCK)
+      except zmq.Again:
+        pass
+
+  def _retransmit(self, event_name, first, last):
+    return self._retransmit_buffer.get(
+      bytes(event_name).decode(),
+      _sequence.unpack(first)[0],
+      _sequence.unpack(last)[0]
+    )
+
+  def _useSharedSockets(self):
+    # reopened sockets replace those the peer was created with
+    out_socket = self._shared_sockets.out_socket
+    for event_name, socket in self._pub_sockets.items():
+      if socket is self._out_socket:
+        self._pub_sockets[event_name] = out_socket
+    self._in_socket = self._shared_sockets.in_socket
+    self._out_socket = out_socket
+
+  def _deliver(self, frames):
+    try:
+      self._inbox.put_nowait(frames)
+    except asyncio.QueueFull:
+      topic = frames[0].bytes
+      event_name = topic[:topic.find(b'\0')].decode(errors = 'replace')
+      count = len(frames) - 1
+      logger.debug('dropped %d %s', count, event_name)
+      if self.metrics:
+        self.metrics.inc('mreventloop_send_dropped_total', (('worker', self.name), ('event', event_name)), count)
+      self.peer_events.dropped(event_name, count)
 
   async def _run(self):
+    frames = await self._receive(self._recv)
+    if self.metrics:
+      self._countMessages('in', len(frames) - 1, sum(len(frame) for frame in frames[1:]))
+    payloads = [ frame.buffer for frame in frames[1:] ]
+    if self._replay_buffer is not None:
+      self._replay_buffer.append((frames[0].bytes, payloads))
+    else:
+      self._dispatch(frames[0].bytes, payloads)
+
+  def _dispatch(self, topic, payloads):
+    separator = topic.find(b'\0')
+    if separator < 0:
+      logger.warning('dropping message without topic')
+      return
+    event_name = topic[:separator].decode()
+    event = self._sub_events.get(event_name)
+    if not event:
+      return
+    if len(topic) > separator + 1:
+      fields = topicFields(topic)
+      if b'C' in fields:
+        if not self._seen(event_name, fields):
+          self._emit(event, payloads)
+        return
+      sequence = fields.get(b'J')
+      if sequence is not None:
+        if sequence <= self.sequence:
+          return
+        self.sequence = sequence
+      if b'S' in fields:
+        self._dispatchSequenced(event_name, event, fields[b'P'], fields[b'S'], payloads)
+        return
+    self._emit(event, payloads)
+
+  def _seen(self, event_name, fields):
+    if b'J' in fields and fields[b'J'] <= self.sequence:
+      return True
+    stream = self._streams.get((fields.get(b'P'), event_name))
+    return b'S' in fields and stream is not None and fields[b'S'] < stream.expected
+
+  def _dispatchSequenced(self, event_name, event, publisher_id, sequence, payloads):
+    key = (publisher_id, event_name)
+    stream = self._streams.get(key)
+    if stream is None:
+      stream = self._streams[key] = Stream(sequence)
+    if sequence < stream.expected:
+      return
+    if stream.held is not None:
+      stream.held[sequence] = payloads
+      return
+    if sequence > stream.expected:
+      if self.rpc:
+        stream.held = { sequence: payloads }
+        task = asyncio.create_task(self._recover(event_name, event, publisher_id, stream))
+        self._recovering.add(task)
+        task.add_done_callback(self._recovering.discard)
+        return
+      self.peer_events.gap(event_name, publisher_id, stream.expected, sequence - 1)
+    stream.expected = sequence + len(payloads)
+    self._emit(event, payloads)
+
+  async def _recover(self, event_name, event, publisher_id, stream):
+    first = stream.expected
+    last = min(stream.held) - 1
     try:
-      request = await asyncio.wait_for(self._in_socket.recv_string(), timeout = 0.1)
-    except asyncio.TimeoutError:
+      payloads = await asyncio.wait_for(
+        self.rpc.callRaw(
+          retransmitMethod(publisher_id),
+          [ event_name.encode(), _sequence.pack(first), _sequence.pack(last) ]
+        ),
+        self.recovery_timeout
+      )
+      logger.debug('recovered %s %d-%d', event_name, first, last)
+      self._emit(event, payloads)
+    except Exception as e:
+      logger.warning('could not recover %s %d-%d: %s', event_name, first, last, e)
+      self.peer_events.gap(event_name, publisher_id, first, last)
+    stream.expected = last + 1
+    held = stream.held
+    stream.held = None
+    for sequence in sorted(held):
+      self._dispatchSequenced(event_name, event, publisher_id, sequence, held[sequence])
+
+  def _emit(self, event, payloads):
+    for payload in payloads:
+      try:
+        event_name, args, kwargs = decodeCall(self.codec, payload)
+      except Exception:
+        logger.warning('dropping undecodable message')
+        continue
+      logger.debug('received: %s %s %s', event_name, args, kwargs)
+      try:
+        event(*args, **kwargs)
+      except Exception:
+        logger.error(traceback.format_exc())
+
+  async def replay(self, sequence):
+    self._replay_buffer = []
+    self.sequence = sequence - 1
+    topics = [ eventToTopic(event_name) for event_name in self._sub_events ]
+    try:
+      end = False
+      while not end:
+        first, next_sequence, end, records = await self.rpc.replay(sequence, topics)
+        if sequence < first:
+          logger.warning('events %d-%d are no longer journaled', sequence, first - 1)
+          for event_name in self._sub_events:
+            self.peer_events.gap(event_name, None, sequence, first - 1)
+        sequence = next_sequence
+        for record in records:
+          frames = decodeFrames(record)
+          self._dispatch(bytes(frames[0]), frames[1:])
+    finally:
+      replay_buffer = self._replay_buffer
+      self._replay_buffer = None
+      for topic, payloads in replay_buffer:
+        self._dispatch(topic, payloads)
+    logger.debug('replayed up to %d', self.sequence)
+
+  def _connectDirect(self, path, event_name):
+    if event_name not in self._sub_events:
       return
-    logger.debug(f'received message: {request}')
-    dispatch(
-      request,
-      methods = self._methods,
-      validator = lambda _: None
-    )
+    event_names = self._direct_paths.setdefault(path, set())
+    if not event_names:
+      if self._shared_sockets:
+        self._shared_sockets.connect(path)
+      else:
+        self._in_socket.connect(path)
+      logger.debug('connected directly to %s', path)
+    event_names.add(event_name)
+
+  def _disconnectDirect(self, path, event_name):
+    event_names = self._direct_paths.get(path)
+    if not event_names:
+      return
+    event_names.discard(event_name)
+    if not event_names:
+      del self._direct_paths[path]
+      if self._shared_sockets:
+        self._shared_sockets.disconnect(path)
+      else:
+        self._in_socket.disconnect(path)
+      logger.debug('disconnected from %s', path)
 
   async def _waitForEvent(self, monitor, event):
     await monitor.recv()
     event.set()
 
-  async def __aenter__(self):
-    asyncio.create_task(self._waitForEvent(
-      self._in_socket.get_monitor_socket(zmq.Event.CONNECTED),
-      self._in_socket_connected
-    ))
-    asyncio.create_task(self._waitForEvent(
-      self._out_socket.get_monitor_socket(zmq.Event.CONNECTED),
-      self._out_socket_connected
-    ))
+  def _monitor(self, socket, path, event):
+    # inproc sockets emit no monitor events, but connect immediately
+    if path.startswith('inproc://'):
+      event.set()
+    else:
+      asyncio.create_task(self._waitForEvent(socket.get_monitor_socket(zmq.Event.CONNECTED), event))
+
+  async def _connect(self):
+    self._monitor(self._in_socket, self._in_socket_path, self._in_socket_connected)
+    self._monitor(self._out_socket, self._out_socket_path, self._out_socket_connected)
 
     self._in_socket.connect(self._in_socket_path)
-    self._in_socket.setsockopt_string(zmq.SUBSCRIBE, '')
+    for event_name in self._sub_events:
+      self._in_socket.setsockopt(zmq.SUBSCRIBE, eventToTopic(event_name))
     self._out_socket.connect(self._out_socket_path)
 
     await self._in_socket_connected.wait()
@@ -92,12 +438,52 @@ class Peer(Worker):
     self._in_socket.disable_monitor()
     self._out_socket.disable_monitor()
 
+  async def __aenter__(self):
+    if self._shared_sockets:
+      await self._shared_sockets.acquire()
+      self._useSharedSockets()
+      self._shared_sockets.subscribe(self._sub_events, self._deliver)
+    else:
+      await self._connect()
+
     await self.event_loop.__aenter__()
+    if self.rpc:
+      await self.rpc.__aenter__()
+      if self._sub_events:
+        await self.rpc.watch(list(self._sub_events))
+    if self._direct_socket:
+      self._direct_socket.bind(self._direct_socket_path)
+      await self.rpc.announce(self._direct_socket_path, self._direct_event_names)
     await super().__aenter__()
+    if self.heartbeat_interval:
+      self._heartbeat_timer = asyncio.get_running_loop().call_later(self.heartbeat_interval, self._heartbeatLater)
+    if self.replay_from is not None:
+      await self.replay(self.replay_from)
     return self
 
   async def __aexit__(self, exc_type, exc_value, traceback):
+    if self._direct_socket:
+      await self.rpc.withdraw(self._direct_socket_path, self._direct_event_names)
+    if self.rpc and self._sub_events:
+      await self.rpc.unwatch(list(self._sub_events))
     await super().__aexit__(exc_type, exc_value, traceback)
+    for task in list(self._recovering):
+      task.cancel()
+    if self.rpc:
+      await self.rpc.__aexit__(exc_type, exc_value, traceback)
+    if self._heartbeat_timer:
+      self._heartbeat_timer.cancel()
+    if self._flush_timer:
+      self._flush_timer.cancel()
+      self._flushLater()
     await self.event_loop.__aexit__(exc_type, exc_value, traceback)
-    self._in_socket.close()
-    self._out_socket.close()
+    if self._shared_sockets:
+      self._shared_sockets.unsubscribe(self._sub_events, self._deliver)
+      for path in self._direct_paths:
+        self._shared_sockets.disconnect(path)
+      await self._shared_sockets.release()
+    else:
+      self._in_socket.close()
+      self._out_socket.close()
+    if self._direct_socket:
+      self._direct_socket.close()
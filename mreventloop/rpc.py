@@ -0,0 +1,297 @@
+# Copyright 2024 Ole Kliemann
+# SPDX-License-Identifier: Apache-2.0
+
+import asyncio
+import inspect
+import itertools
+import struct
+import traceback
+import zmq
+from mreventloop.worker import Worker
+from mreventloop.decorators import emits
+from mreventloop.journal import decodeFrames
+from mreventloop.codec import decodeCall
+from mreventloop.slot_call import SlotCall
+import logging
+
+logger = logging.getLogger(__name__)
+
+REGISTER = b'REGISTER'
+UNREGISTER = b'UNREGISTER'
+CALL = b'CALL'
+REPLY = b'REPLY'
+ANNOUNCE = b'ANNOUNCE'
+WITHDRAW = b'WITHDRAW'
+WATCH = b'WATCH'
+UNWATCH = b'UNWATCH'
+PING = b'PING'
+REPLAY = b'REPLAY'
+OK = b'OK'
+ERROR = b'ERROR'
+
+_uint64 = struct.Struct('!Q')
+
+class RpcError(Exception):
+  pass
+
+class RpcRouter(Worker):
+  # frames each command needs at least, after the sender and command
+  _min_frames = { CALL: 2, REPLY: 1, ANNOUNCE: 1, WITHDRAW: 1, REPLAY: 2 }
+
+  def __init__(self, ctx, socket_path, journal = None, replay_page_size = 100):
+    super().__init__()
+    self.socket_path = socket_path
+    self.socket = ctx.socket(zmq.ROUTER)
+    self.socket.setsockopt(zmq.ROUTER_MANDATORY, 1)
+    self.journal = journal
+    self.replay_page_size = replay_page_size
+    self._methods = {}
+    self._directory = {}
+    self._watchers = {}
+
+  async def _run(self):
+    message = await self._receive(lambda: self.socket.recv_multipart())
+    if len(message) < 2 or len(message) - 2 < self._min_frames.get(message[1], 0):
+      logger.warning('dropping malformed rpc message')
+      return
+    sender, command, *frames = message
+    if command == CALL:
+      request_id, method = frames[0], frames[1]
+      server = self._methods.get(method)
+      if server is None or not await self._send(server, [ CALL, sender ] + frames):
+        await self._send(sender, [ REPLY, request_id, ERROR, b'no such method: ' + method ])
+    elif command == REPLY:
+      client, *frames = frames
+      await self._send(client, [ REPLY ] + frames)
+    elif command == REGISTER:
+      for method in frames:
+        self._methods[method] = sender
+      logger.debug('registered %s', frames)
+    elif command == UNREGISTER:
+      for method in frames:
+        if self._methods.get(method) == sender:
+          del self._methods[method]
+    elif command == ANNOUNCE:
+      path, *event_names = frames
+      for event_name in event_names:
+        self._directory.setdefault(event_name, {})[path] = sender
+        await self._notify(ANNOUNCE, path, event_name)
+    elif command == WITHDRAW:
+      path, *event_names = frames
+      for event_name in event_names:
+        announcers = self._directory.get(event_name, {})
+        if announcers.pop(path, None):
+          if not announcers:
+            del self._directory[event_name]
+          await self._notify(WITHDRAW, path, event_name)
+    elif command == REPLAY:
+      request_id, sequence, *topics = frames
+      if len(sequence) != _uint64.size:
+        logger.warning('dropping malformed rpc message')
+      elif self.journal is None:
+        await self._send(sender, [ REPLY, request_id, ERROR, b'no journal' ])
+      else:
+        # events before the first kept segment are gone, which the first frame tells the peer
+        first = self.journal.first_sequence
+        page = self._replayPage(max(_uint64.unpack(sequence)[0], first), topics)
+        await self._send(sender, [ REPLY, request_id, OK, _uint64.pack(first) ] + page)
+    elif command == WATCH:
+      for event_name in frames:
+        self._watchers.setdefault(event_name, set()).add(sender)
+        for path, announcer in list(self._directory.get(event_name, {}).items()):
+          # drops the announcement if its peer has gone without withdrawing
+          if await self._send(announcer, [ PING ]):
+            await self._send(sender, [ ANNOUNCE, path, event_name ])
+    elif command == UNWATCH:
+      for event_name in frames:
+        watchers = self._watchers.get(event_name, set())
+        watchers.discard(sender)
+        if not watchers:
+          self._watchers.pop(event_name, None)
+    else:
+      logger.warning('dropping unknown rpc command')
+
+  def _replayPage(self, sequence, topics):
+    records = []
+    topics = tuple(topics)
+    for scanned, (record_sequence, record) in enumerate(self.journal.read(sequence), 1):
+      sequence = record_sequence + 1
+      if bytes(decodeFrames(record)[0]).startswith(topics):
+        records.append(record)
+      if len(records) == self.replay_page_size or scanned == 100 * self.replay_page_size:
+        break
+    end = b'\1' if sequence >= self.journal.next_sequence else b'\0'
+    return [ _uint64.pack(sequence), end ] + records
+
+  async def _notify(self, command, path, event_name):
+    for watcher in list(self._watchers.get(event_name, ())):
+      await self._send(watcher, [ command, path, event_name ])
+
+  async def _send(self, identity, frames):
+    try:
+      await self.socket.send_multipart([ identity ] + frames)
+      return True
+    except zmq.ZMQError as e:
+      if e.errno != zmq.EHOSTUNREACH:
+        raise
+      await self._forget(identity)
+      return False
+
+  async def _forget(self, identity):
+    logger.debug('forgetting unreachable peer %s', identity)
+    for method, server in list(self._methods.items()):
+      if server == identity:
+        del self._methods[method]
+    for event_name, watchers in list(self._watchers.items()):
+      watchers.discard(identity)
+      if not watchers:
+        del self._watchers[event_name]
+    for event_name, announcers in list(self._directory.items()):
+      for path, announcer in list(announcers.items()):
+        if announcer == identity:
+          del announcers[path]
+          await self._notify(WITHDRAW, path, event_name)
+      if not announcers:
+        del self._directory[event_name]
+
+  async def __aenter__(self):
+    self.socket.bind(self.socket_path)
+    return await super().__aenter__()
+
+  async def __aexit__(self, exc_type, exc_value, traceback):
+    await super().__aexit__(exc_type, exc_value, traceback)
+    self.socket.close()
+
+class RpcCalls:
+  def __init__(self, endpoint):
+    self._endpoint = endpoint
+
+  def __getattr__(self, method):
+    return lambda *args: self._endpoint.call(method, *args)
+
+@emits('events', [ 'announced', 'withdrawn' ])
+class RpcEndpoint(Worker):
+  # frames each command needs at least, after the command
+  _min_frames = { REPLY: 2, CALL: 3, ANNOUNCE: 2, WITHDRAW: 2 }
+
+  def __init__(self, ctx, socket_path, codec, timeout = 10):
+    super().__init__()
+    self.socket_path = socket_path
+    self.socket = ctx.socket(zmq.DEALER)
+    self.codec = codec
+    self.timeout = timeout
+    self._methods = {}
+    self._raw_methods = set()
+    self._pending = {}
+    self._request_ids = itertools.count()
+    self._serving = set()
+
+  def serve(self, method, function, raw = False):
+    self._methods[method.encode()] = function
+    if raw:
+      self._raw_methods.add(method.encode())
+    if self.main:
+      task = asyncio.create_task(self._register([ method.encode() ]))
+      self._serving.add(task)
+      task.add_done_callback(self._serving.discard)
+
+  async def _register(self, methods):
+    try:
+      await self.socket.send_multipart([ REGISTER ] + methods)
+    except Exception:
+      logger.error(traceback.format_exc())
+
+  async def announce(self, path, event_names):
+    await self.socket.send_multipart([ ANNOUNCE, path.encode() ] + [ name.encode() for name in event_names ])
+
+  async def withdraw(self, path, event_names):
+    await self.socket.send_multipart([ WITHDRAW, path.encode() ] + [ name.encode() for name in event_names ])
+
+  async def watch(self, event_names):
+    await self.socket.send_multipart([ WATCH ] + [ name.encode() for name in event_names ])
+
+  async def unwatch(self, event_names):
+    await self.socket.send_multipart([ UNWATCH ] + [ name.encode() for name in event_names ])
+
+  async def call(self, method, *args):
+    payload, = await self._request(CALL, [ method.encode(), self.codec.encode(method, args) ])
+    return self.codec.decode(payload)[1][0]
+
+  async def callRaw(self, method, frames):
+    return await self._request(CALL, [ method.encode() ] + frames)
+
+  async def replay(self, sequence, topics):
+    first, next_sequence, end, *records = await self._request(REPLAY, [ _uint64.pack(sequence) ] + topics)
+    return _uint64.unpack(first)[0], _uint64.unpack(next_sequence)[0], end == b'\1', records
+
+  async def _request(self, command, frames):
+    request_id = _uint64.pack(next(self._request_ids))
+    future = asyncio.get_running_loop().create_future()
+    self._pending[request_id] = future
+    try:
+      await self.socket.send_multipart([ command, request_id ] + frames)
+      return await asyncio.wait_for(future, self.timeout)
+    finally:
+      self._pending.pop(request_id, None)
+
+  async def _run(self):
+    message = await self._receive(lambda: self.socket.recv_multipart())
+    if not message or len(message) - 1 < self._min_frames.get(message[0], 0):
+      logger.warning('dropping malformed rpc message')
+      return
+    command, *frames = message
+    if command == REPLY:
+      request_id, status, *payload = frames
+      future = self._pending.get(request_id)
+      if future is None or future.done():
+        return
+      if status == OK:
+        future.set_result(payload)
+      else:
+        future.set_exception(RpcError(payload[0].decode(errors = 'replace') if payload else 'failed'))
+    elif command == CALL:
+      task = asyncio.create_task(self._serve(*frames))
+      self._serving.add(task)
+      task.add_done_callback(self._serving.discard)
+    elif command == ANNOUNCE:
+      self.events.announced(frames[0].decode(errors = 'replace'), frames[1].decode(errors = 'replace'))
+    elif command == WITHDRAW:
+      self.events.withdrawn(frames[0].decode(errors = 'replace'), frames[1].decode(errors = 'replace'))
+    elif command == PING:
+      pass
+    else:
+      logger.warning('dropping unknown rpc command')
+
+  async def _serve(self, client, request_id, method, *payload):
+    try:
+      function = self._methods[method]
+      if method in self._raw_methods:
+        reply = [ OK ] + function(*payload)
+      else:
+        method_name, args, kwargs = decodeCall(self.codec, payload[0])
+        call = function(*args, **kwargs)
+        result = await call if inspect.isawaitable(call) else call
+        if isinstance(call, SlotCall) and call._exception is not None:
+          raise call._exception
+        reply = [ OK, self.codec.encode('result', [ result ]) ]
+    except Exception as e:
+      logger.error(traceback.format_exc())
+      reply = [ ERROR, f'{type(e).__name__}: {e}'.encode() ]
+    await self.socket.send_multipart([ REPLY, client, request_id ] + reply)
+
+  async def __aenter__(self):
+    self.socket.connect(self.socket_path)
+    if self._methods:
+      await self._register(list(self._methods))
+    return await super().__aenter__()
+
+  async def __aexit__(self, exc_type, exc_value, traceback):
+    if self._methods:
+      await self.socket.send_multipart([ UNREGISTER ] + list(self._methods))
+    await super().__aexit__(exc_type, exc_value, traceback)
+    for task in list(self._serving):
+      task.cancel()
+    for future in self._pending.values():
+      if not future.done():
+        future.cancel()
+    self.socket.close()
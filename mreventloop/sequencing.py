@@ -0,0 +1,31 @@
+# Copyright 2024 Ole Kliemann
+# SPDX-License-Identifier: Apache-2.0
+
+from collections import deque
+from itertools import islice
+
+class Stream:
+  __slots__ = ('expected', 'held')
+
+  def __init__(self, expected):
+    self.expected = expected
+    self.held = None
+
+class RetransmitBuffer:
+  def __init__(self, size):
+    self.size = size
+    self._buffers = {}
+
+  def append(self, event_name, sequence, payloads):
+    buffer = self._buffers.get(event_name)
+    if buffer is None:
+      buffer = self._buffers[event_name] = deque(maxlen = self.size)
+    for i, payload in enumerate(payloads):
+      buffer.append((sequence + i, payload))
+
+  def get(self, event_name, first, last):
+    buffer = self._buffers.get(event_name)
+    if not buffer or first < buffer[0][0] or last > buffer[-1][0]:
+      raise LookupError(f'{event_name} {first}-{last} no longer buffered')
+    start = first - buffer[0][0]
+    return [ payload for sequence, payload in islice(buffer, start, start + last - first + 1) ]
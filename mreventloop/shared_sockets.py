@@ -0,0 +1,128 @@
+# Copyright 2024 Ole Kliemann
+# SPDX-License-Identifier: Apache-2.0
+
+import asyncio
+import zmq
+from mreventloop.worker import Worker
+from mreventloop.names import eventToTopic
+from mreventloop.context import sharedContext
+from mreventloop.flow_control import publishSocket, setSocketOptions
+import logging
+
+logger = logging.getLogger(__name__)
+
+class SharedSockets(Worker):
+  def __init__(
+    self,
+    in_socket_path,
+    out_socket_path,
+    ctx = None,
+    socket_options = None,
+    publish_overflow = None
+  ):
+    super().__init__()
+    self.in_socket_path = in_socket_path
+    self.out_socket_path = out_socket_path
+    self.publish_overflow = publish_overflow
+    self.ctx = ctx or sharedContext()
+    self._socket_options = socket_options or {}
+    self._open()
+    # peers' inboxes hold as many messages as the socket would
+    self.inbox_size = self.in_socket.getsockopt(zmq.RCVHWM)
+    self._inboxes = {}
+    self._paths = {}
+    self._users = 0
+    self._ready = None
+
+  def _open(self):
+    self.in_socket = self.ctx.socket(zmq.SUB)
+    setSocketOptions(self.in_socket, self._socket_options.get('in'))
+    self.out_socket = publishSocket(self.ctx, self.publish_overflow, self._socket_options.get('out'))
+
+  def subscribe(self, event_names, deliver):
+    for event_name in event_names:
+      inboxes = self._inboxes.setdefault(event_name.encode(), [])
+      if not inboxes:
+        self.in_socket.setsockopt(zmq.SUBSCRIBE, eventToTopic(event_name))
+      inboxes.append(deliver)
+
+  def unsubscribe(self, event_names, deliver):
+    for event_name in event_names:
+      inboxes = self._inboxes[event_name.encode()]
+      inboxes.remove(deliver)
+      if not inboxes:
+        del self._inboxes[event_name.encode()]
+        self.in_socket.setsockopt(zmq.UNSUBSCRIBE, eventToTopic(event_name))
+
+  def connect(self, path):
+    self._paths[path] = self._paths.get(path, 0) + 1
+    if self._paths[path] == 1:
+      self.in_socket.connect(path)
+
+  def disconnect(self, path):
+    self._paths[path] -= 1
+    if not self._paths[path]:
+      del self._paths[path]
+      self.in_socket.disconnect(path)
+
+  async def acquire(self):
+    if self._ready is None:
+      self._ready = asyncio.ensure_future(self.__aenter__())
+    self._users += 1
+    try:
+      await asyncio.shield(self._ready)
+    except BaseException:
+      await self.release()
+      raise
+
+  async def release(self):
+    self._users -= 1
+    if self._users:
+      return
+    ready = self._ready
+    self._ready = None
+    try:
+      await ready
+    except Exception:
+      # failed to connect, reported to acquire() already
+      self.in_socket.close()
+      self.out_socket.close()
+      return
+    await self.__aexit__(None, None, None)
+
+  async def _run(self):
+    frames = await self._receive(lambda: self.in_socket.recv_multipart(copy = False))
+    topic = frames[0].bytes
+    for deliver in self._inboxes.get(topic[:topic.find(b'\0')], ()):
+      deliver(frames)
+
+  async def _waitForEvent(self, monitor, event):
+    await monitor.recv()
+    event.set()
+
+  async def __aenter__(self):
+    # the sockets are closed when the last peer leaves, and reopened for the next one
+    if self.in_socket.closed:
+      self._open()
+    self.stop_event.clear()
+    connected = [ asyncio.Event(), asyncio.Event() ]
+    sockets = [ (self.in_socket, self.in_socket_path), (self.out_socket, self.out_socket_path) ]
+    for (socket, path), event in zip(sockets, connected):
+      # inproc sockets emit no monitor events, but connect immediately
+      if path.startswith('inproc://'):
+        event.set()
+      else:
+        asyncio.create_task(self._waitForEvent(socket.get_monitor_socket(zmq.Event.CONNECTED), event))
+    self.in_socket.connect(self.in_socket_path)
+    self.out_socket.connect(self.out_socket_path)
+    for event in connected:
+      await event.wait()
+    self.in_socket.disable_monitor()
+    self.out_socket.disable_monitor()
+    logger.debug('connected shared sockets to %s and %s', self.in_socket_path, self.out_socket_path)
+    return await super().__aenter__()
+
+  async def __aexit__(self, exc_type, exc_value, traceback):
+    await super().__aexit__(exc_type, exc_value, traceback)
+    self.in_socket.close()
+    self.out_socket.close()
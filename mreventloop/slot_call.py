@@ -3,24 +3,63 @@
 
 import asyncio
 import inspect
-from mreventloop.make_awaitable import make_awaitable
+from functools import partial
 
 class SlotCall:
-  def __init__(self, target, args, kwargs):
+  __slots__ = ('_target', '_args', '_kwargs', '_result', '_done', '_future', '_key', '_priority', '_executor', '_callbacks', '_coalesce', '_enqueued', '_exception', '_receiver')
+
+  def __init__(self, target, args, kwargs, priority = 0, executor = None, receiver = None):
     self._target = target
     self._args = args
     self._kwargs = kwargs
-    self._result_ready = asyncio.Event()
     self._result = None
+    self._done = False
+    self._future = None
+    self._key = None
+    self._priority = priority
+    self._executor = executor
+    self._callbacks = None
+    self._coalesce = None
+    self._enqueued = None
+    self._exception = None
+    self._receiver = receiver
 
   def __await__(self):
-    yield from self._result_ready.wait().__await__()
+    if not self._done:
+      if self._future is None:
+        self._future = asyncio.get_event_loop().create_future()
+      yield from asyncio.shield(self._future).__await__()
     return self._result
 
-  async def _run(self):
-    self._result = await make_awaitable(self._target(*self._args, **self._kwargs))
-    self._result_ready.set()
+  def _addCallback(self, callback):
+    if self._done:
+      callback(self._result)
+    elif self._callbacks is None:
+      self._callbacks = [ callback ]
+    else:
+      self._callbacks.append(callback)
+
+  def _setResult(self, result):
+    self._result = result
+    self._done = True
+    if self._future is not None and not self._future.done():
+      self._future.set_result(None)
+    if self._callbacks is not None:
+      for callback in self._callbacks:
+        callback(result)
+
+  async def _run(self, executor = None):
+    if executor:
+      result = await asyncio.get_event_loop().run_in_executor(
+        executor,
+        partial(self._target, *self._args, **self._kwargs)
+      )
+    else:
+      result = self._target(*self._args, **self._kwargs)
+    if inspect.isawaitable(result):
+      result = await result
+    self._setResult(result)
 
-  async def _error(self):
-    self._result = await make_awaitable(None)
-    self._result_ready.set()
+  async def _error(self, exception = None):
+    self._exception = exception
+    self._setResult(None)
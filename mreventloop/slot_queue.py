@@ -0,0 +1,112 @@
+# Copyright 2024 Ole Kliemann
+# SPDX-License-Identifier: Apache-2.0
+
+import asyncio
+from collections import deque
+
+class SlotQueue:
+  def __init__(self, maxsize = 0, starvation_limit = 100):
+    self.maxsize = maxsize
+    self.starvation_limit = starvation_limit
+    self._lanes = { 0: deque() }
+    self._priorities = [ 0 ]
+    self._count = 0
+    self._starved = 0
+    self._rotation = 0
+    self._parked = deque()
+    self._keyed = {}
+    self._getter = None
+    self._putters = deque()
+
+  def __len__(self):
+    return self._count + len(self._parked)
+
+  def empty(self):
+    return not self._count and not self._parked
+
+  def full(self):
+    return self.maxsize > 0 and self._count >= self.maxsize
+
+  def find(self, key):
+    return self._keyed.get(key)
+
+  def put_nowait(self, item):
+    priority = item._priority if item is not None else 0
+    lane = self._lanes.get(priority)
+    if lane is None:
+      lane = self._lanes[priority] = deque()
+      self._priorities = sorted(self._lanes, reverse = True)
+    lane.append(item)
+    self._count += 1
+    if item is not None and item._key is not None:
+      self._keyed[item._key] = item
+    if self._getter is not None and not self._getter.done():
+      self._getter.set_result(None)
+
+  def park(self, item, first = False):
+    if first:
+      self._parked.appendleft(item)
+      return
+    if self.maxsize > 0 and len(self._parked) >= self.maxsize:
+      raise asyncio.QueueFull()
+    self._parked.append(item)
+
+  def hasRoom(self):
+    return not self.full() and not self._parked
+
+  async def waitForRoom(self):
+    while not self.hasRoom():
+      putter = asyncio.get_event_loop().create_future()
+      self._putters.append(putter)
+      await putter
+
+  def get_nowait(self):
+    if len(self._priorities) == 1:
+      return self._pop(self._lanes[self._priorities[0]])
+    lanes = [ self._lanes[priority] for priority in self._priorities if self._lanes[priority] ]
+    if len(lanes) > 1 and self._starved >= self.starvation_limit:
+      self._starved = 0
+      self._rotation += 1
+      return self._pop(lanes[1 + self._rotation % (len(lanes) - 1)])
+    self._starved = self._starved + 1 if len(lanes) > 1 else 0
+    return self._pop(lanes[0])
+
+  def drop(self):
+    for priority in reversed(self._priorities):
+      if self._lanes[priority]:
+        return self._pop(self._lanes[priority])
+
+  def evict(self, priority):
+    for lane_priority in reversed(self._priorities):
+      if lane_priority >= priority:
+        return None
+      lane = self._lanes[lane_priority]
+      if lane:
+        item = lane.pop()
+        self._count -= 1
+        if item is not None and item._key is not None and self._keyed.get(item._key) is item:
+          del self._keyed[item._key]
+        return item
+
+  def _pop(self, lane):
+    item = lane.popleft()
+    self._count -= 1
+    if item is not None and item._key is not None and self._keyed.get(item._key) is item:
+      del self._keyed[item._key]
+    if self._parked and not self.full():
+      self.put_nowait(self._parked.popleft())
+    while self._putters and self.hasRoom():
+      putter = self._putters.popleft()
+      if not putter.done():
+        putter.set_result(None)
+        break
+    return item
+
+  async def get(self):
+    while not self._count:
+      self._getter = asyncio.get_event_loop().create_future()
+      try:
+        await self._getter
+      finally:
+        self._getter = None
+    return self.get_nowait()
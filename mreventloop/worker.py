@@ -9,17 +9,41 @@ import sys
 logger = logging.getLogger(__name__)
 
 class Worker:
-  def __init__(self):
+  def __init__(self, metrics = None, name = None):
     self.stop_event = asyncio.Event()
     self.main = None
+    self._receiving = False
+    self.name = name or f'{type(self).__name__}-{id(self):x}'
+    self.metrics = metrics
+    self._metric_labels = {
+      direction: (('worker', self.name), ('direction', direction))
+      for direction in [ 'in', 'out' ]
+    }
+
+  def _countMessages(self, direction, messages, size):
+    labels = self._metric_labels[direction]
+    self.metrics.inc('mreventloop_messages_total', labels, messages)
+    self.metrics.inc('mreventloop_bytes_total', labels, size)
 
   async def _run(self):
     pass
 
+  async def _receive(self, receive):
+    if self.stop_event.is_set():
+      raise asyncio.CancelledError()
+    self._receiving = True
+    try:
+      return await receive()
+    finally:
+      self._receiving = False
+
   async def _run_task(self):
     while not self.stop_event.is_set():
       try:
         await self._run()
+      except asyncio.CancelledError:
+        if not self.stop_event.is_set():
+          raise
       except Exception as e:
         logger.error(traceback.format_exc())
         sys.exit(1)
@@ -32,6 +56,8 @@ class Worker:
   async def __aexit__(self, exc_type, exc_value, traceback):
     self.stop_event.set()
     logger.debug('stopping')
+    if self._receiving:
+      self.main.cancel()
     await self.main
 
   def __await__(self):
@@ -0,0 +1,52 @@
+# Copyright 2023 Ole Kliemann
+# SPDX-License-Identifier: GPL-3.0-or-later
+
+import json
+import pytest
+from mreventloop import JsonRpcCodec, BinaryCodec, RawCodec
+
+def test_json_rpc_codec_is_json_rpc():
+  codec = JsonRpcCodec()
+  data = codec.encode('produced', ( 'foo', 1 ))
+  message = json.loads(data)
+  assert message['jsonrpc'] == '2.0'
+  assert message['method'] == 'produced'
+  assert codec.decode(data) == ( 'produced', [ 'foo', 1 ] )
+
+def test_binary_codec_roundtrip():
+  codec = BinaryCodec()
+  args = [
+    None, True, False, 0, -1, 2**70, -2**70, 1.5, 'föö', b'\x00\xff',
+    [ 1, [ 'a', b'b' ] ], { 'key': [ 1, 2 ], 3: None }
+  ]
+  assert codec.decode(codec.encode('produced', args)) == ( 'produced', args )
+
+def test_binary_codec_is_compact_for_bytes():
+  codec = BinaryCodec()
+  payload = bytes(range(256)) * 4
+  data = codec.encode('produced', [ payload ])
+  assert len(data) < len(payload) + 32
+  assert codec.decode(data) == ( 'produced', [ payload ] )
+
+def test_binary_codec_rejects_unknown_types():
+  with pytest.raises(TypeError):
+    BinaryCodec().encode('produced', [ object() ])
+
+def test_binary_codec_rejects_malformed_data():
+  codec = BinaryCodec()
+  data = codec.encode('produced', [ 'foo', 1 ])
+  for malformed in [ data[:-1], data[:-8], data[:3], data + b'N' ]:
+    with pytest.raises(ValueError):
+      codec.decode(malformed)
+
+def test_raw_codec_passes_bytes_through():
+  codec = RawCodec()
+  payload = bytearray(b'\x00raw\xff')
+  data = codec.encode('produced', [ payload ])
+  assert data.endswith(payload)
+  assert codec.decode(data) == ( 'produced', [ bytes(payload) ] )
+
+def test_json_rpc_codec_decodes_named_params():
+  codec = JsonRpcCodec()
+  data = json.dumps({ 'jsonrpc': '2.0', 'method': 'produced', 'params': { 'x': 1, 'y': 'foo' }, 'id': 1 })
+  assert codec.decode(data.encode()) == ( 'produced', [], { 'x': 1, 'y': 'foo' } )
@@ -1,7 +1,9 @@
 # Copyright 2023 Ole Kliemann
 # SPDX-License-Identifier: GPL-3.0-or-later
 
-from mreventloop import emits, slot, forwards, connect, disconnect
+import gc
+import pytest
+from mreventloop import emits, slot, forwards, connect, disconnect, has_event_loop
 
 @forwards([ 'onResult' ])
 @emits('events', [ 'result' ])
@@ -212,3 +214,56 @@ def test_disconnect():
   sender.sendRequest('bar')
 
   assert receiver.content == [ 'foo' ]
+
+def test_connected_slot_listener_compares_to_slot():
+  sender = Sender()
+  receiver = Receiver()
+
+  connect(sender, 'request', receiver, 'onRequest')
+
+  assert sender.events.request.listeners == [ receiver.onRequest ]
+  assert sender.events.request.listeners[0] is not receiver.onRequest
+
+def test_weak_connect():
+  sender = Sender()
+  receiver = Receiver()
+  content = receiver.content
+
+  connect(sender, 'request', receiver, 'onRequest', weak = True)
+  sender.sendRequest('foo')
+  del receiver
+  gc.collect()
+  sender.sendRequest('bar')
+
+  assert content == [ 'foo' ]
+  assert sender.events.request.listeners == []
+
+@has_event_loop('event_loop')
+class LoopReceiver:
+  def __init__(self):
+    self.content = []
+
+  @slot
+  def onRequest(self, req):
+    self.content.append(req)
+
+@pytest.mark.asyncio
+async def test_weak_connect_enqueues_on_event_loop():
+  sender = Sender()
+  receiver = LoopReceiver()
+
+  connect(sender, 'request', receiver, 'onRequest', weak = True)
+  assert sender.events.request.listeners == [ receiver.onRequest ]
+  async with receiver.event_loop:
+    sender.sendRequest('foo')
+    assert receiver.content == []
+  assert receiver.content == [ 'foo' ]
+
+  disconnect(sender, 'request', receiver, 'onRequest')
+  assert sender.events.request.listeners == []
+
+def test_weak_connect_rejects_functions():
+  sender = Sender()
+  with pytest.raises(TypeError):
+    connect(sender, 'request', lambda req: None, weak = True)
+  assert sender.events.request.listeners == []
@@ -1,9 +1,13 @@
 # Copyright 2023 Ole Kliemann
 # SPDX-License-Identifier: GPL-3.0-or-later
 
+import os
+import time
 import asyncio
+import threading
+import concurrent.futures
 import pytest
-from mreventloop import emits, slot, forwards, connect, EventLoop, setEventLoop, has_event_loop
+from mreventloop import emits, slot, forwards, connect, EventLoop, EventLoopThread, EventLoopGroup, setEventLoop, has_event_loop
 
 @has_event_loop('event_loop')
 @emits('events', [ 'result' ])
@@ -280,3 +284,479 @@ async def test_event_loop_started_stopped():
     'final'
   ]:
     assert item in consumer.content
+
+@pytest.mark.asyncio
+async def test_batched_event_loop_emits_active_idle_per_batch():
+  transitions = []
+  consumer = Consumer()
+  setEventLoop(consumer, EventLoop(batch_size = 4))
+  connect(consumer.event_loop, 'active', lambda: transitions.append('active'))
+  connect(consumer.event_loop, 'idle', lambda: transitions.append('idle'))
+
+  for i in range(10):
+    consumer.onProcessedResult(i)
+  async with consumer.event_loop:
+    pass
+
+  assert consumer.content == list(range(10))
+  assert transitions == [ 'idle' ] + [ 'active', 'idle' ] * 3
+
+@pytest.mark.asyncio
+async def test_batched_event_loop_unlimited_batch():
+  transitions = []
+  consumer = Consumer()
+  setEventLoop(consumer, EventLoop(batch_size = None, batch_time = 1.0))
+  connect(consumer.event_loop, 'active', lambda: transitions.append('active'))
+
+  for i in range(100):
+    consumer.onProcessedResult(i)
+  async with consumer.event_loop:
+    pass
+
+  assert consumer.content == list(range(100))
+  assert transitions == [ 'active' ]
+
+@pytest.mark.asyncio
+async def test_slot_return_awaited_after_completion():
+  a = SlotWithReturnValue()
+  async with a.event_loop:
+    result = a.call()
+  assert not hasattr(result, '__dict__')
+  assert await result == 'foo'
+  assert await result == 'foo'
+
+@pytest.mark.asyncio
+async def test_post_fire_and_forget():
+  consumer = Consumer()
+  async with consumer.event_loop:
+    assert consumer.event_loop.post(consumer.content.append, 'foo') is None
+  assert consumer.content == [ 'foo' ]
+
+@has_event_loop('event_loop')
+class State:
+  def __init__(self):
+    self.content = []
+
+  @slot
+  def onChanged(self, key, value):
+    self.content.append((key, value))
+
+async def fillBoundedLoop(overflow, **kwargs):
+  state = State()
+  setEventLoop(state, EventLoop(maxsize = 3, overflow = overflow, **kwargs))
+  overflows = []
+  connect(state.event_loop, 'overflow', lambda policy: overflows.append(policy))
+  results = [ state.onChanged(i % 2, i) for i in range(6) ]
+  async with state.event_loop:
+    pass
+  return state.content, overflows, [ await result for result in results ]
+
+@pytest.mark.asyncio
+async def test_bounded_loop_block():
+  content, overflows, results = await fillBoundedLoop('block')
+  assert content == [ (i % 2, i) for i in range(6) ]
+  assert overflows == [ 'block' ] * 3
+
+@pytest.mark.asyncio
+async def test_bounded_loop_block_limits_waiting_calls():
+  state = State()
+  setEventLoop(state, EventLoop(maxsize = 3, overflow = 'block'))
+  results = [ state.onChanged(i % 2, i) for i in range(6) ]
+  with pytest.raises(asyncio.QueueFull):
+    state.onChanged(0, 6)
+  assert len(state.event_loop.queue) == 6
+  async with state.event_loop:
+    await results[-1]
+  assert state.content == [ (i % 2, i) for i in range(6) ]
+
+@pytest.mark.asyncio
+async def test_bounded_loop_wait_for_room():
+  state = State()
+  setEventLoop(state, EventLoop(maxsize = 3, overflow = 'block'))
+  overflows = []
+  connect(state.event_loop, 'overflow', lambda policy: overflows.append(policy))
+  async def produce():
+    for i in range(10):
+      await state.event_loop.waitForRoom()
+      state.onChanged(i % 2, i)
+      assert len(state.event_loop.queue) <= 3
+  async with state.event_loop:
+    await produce()
+  assert state.content == [ (i % 2, i) for i in range(10) ]
+  assert overflows == []
+
+@pytest.mark.asyncio
+async def test_bounded_loop_drop_newest():
+  content, overflows, results = await fillBoundedLoop('drop_newest')
+  assert content == [ (0, 0), (1, 1), (0, 2) ]
+  assert overflows == [ 'drop_newest' ] * 3
+
+@pytest.mark.asyncio
+async def test_bounded_loop_drop_oldest():
+  content, overflows, results = await fillBoundedLoop('drop_oldest')
+  assert content == [ (1, 3), (0, 4), (1, 5) ]
+  assert overflows == [ 'drop_oldest' ] * 3
+
+@pytest.mark.asyncio
+async def test_bounded_loop_coalesce():
+  content, overflows, results = await fillBoundedLoop(
+    'coalesce',
+    coalesce_key = lambda target, state, key, value: key
+  )
+  assert content == [ (0, 0), (1, 5), (0, 4) ]
+  assert overflows == [ 'coalesce' ] * 3
+
+@pytest.mark.asyncio
+async def test_bounded_loop_coalesce_default_key():
+  event_loop = EventLoop(maxsize = 3, overflow = 'coalesce')
+  first, second = State(), State()
+  setEventLoop(first, event_loop)
+  setEventLoop(second, event_loop)
+  content = []
+  first.onChanged(0, 0)
+  second.onChanged(0, 1)
+  event_loop.post(content.append, 'a')
+  first.onChanged(0, 2)
+  second.onChanged(0, 3)
+  event_loop.post(content.append, 'b')
+  async with event_loop:
+    pass
+  assert first.content == [ (0, 2) ]
+  assert second.content == [ (0, 3) ]
+  assert content == [ 'b' ]
+
+@has_event_loop('event_loop')
+class Lanes:
+  def __init__(self):
+    self.content = []
+
+  @slot
+  def onBulk(self, value):
+    self.content.append(('bulk', value))
+
+  @slot(priority = 5)
+  def onStatus(self, value):
+    self.content.append(('status', value))
+
+  @slot(priority = 10)
+  def onControl(self, value):
+    self.content.append(('control', value))
+
+@pytest.mark.asyncio
+async def test_priority_slots_run_first():
+  lanes = Lanes()
+  for i in range(3):
+    lanes.onBulk(i)
+  lanes.onControl(0)
+  lanes.onControl(1)
+  async with lanes.event_loop:
+    pass
+  assert lanes.content == [
+    ('control', 0), ('control', 1), ('bulk', 0), ('bulk', 1), ('bulk', 2)
+  ]
+
+@pytest.mark.asyncio
+async def test_priority_starvation_protection():
+  lanes = Lanes()
+  setEventLoop(lanes, EventLoop(starvation_limit = 2))
+  for i in range(2):
+    lanes.onBulk(i)
+  for i in range(5):
+    lanes.onControl(i)
+  async with lanes.event_loop:
+    pass
+  assert lanes.content == [
+    ('control', 0), ('control', 1), ('bulk', 0),
+    ('control', 2), ('control', 3), ('bulk', 1),
+    ('control', 4)
+  ]
+
+@pytest.mark.asyncio
+async def test_priority_starvation_protection_rotates_lanes():
+  lanes = Lanes()
+  setEventLoop(lanes, EventLoop(starvation_limit = 2))
+  for i in range(2):
+    lanes.onBulk(i)
+    lanes.onStatus(i)
+  for i in range(6):
+    lanes.onControl(i)
+  async with lanes.event_loop:
+    pass
+  assert lanes.content == [
+    ('control', 0), ('control', 1), ('bulk', 0),
+    ('control', 2), ('control', 3), ('status', 0),
+    ('control', 4), ('control', 5), ('bulk', 1),
+    ('status', 1)
+  ]
+
+@pytest.mark.asyncio
+async def test_priority_bounded_loop_drop_newest():
+  lanes = Lanes()
+  setEventLoop(lanes, EventLoop(maxsize = 3, overflow = 'drop_newest'))
+  results = [ lanes.onBulk(i) for i in range(4) ]
+  lanes.onControl(0)
+  lanes.onControl(1)
+  async with lanes.event_loop:
+    pass
+  assert lanes.content == [ ('control', 0), ('control', 1), ('bulk', 0) ]
+  assert [ await result for result in results ] == [ None ] * 4
+
+@pytest.mark.asyncio
+async def test_priority_bounded_loop_block():
+  lanes = Lanes()
+  setEventLoop(lanes, EventLoop(maxsize = 2, overflow = 'block'))
+  for i in range(3):
+    lanes.onBulk(i)
+  lanes.onControl(0)
+  lanes.onControl(1)
+  assert len(lanes.event_loop.queue) == 5
+  async with lanes.event_loop:
+    pass
+  assert lanes.content == [
+    ('control', 0), ('control', 1), ('bulk', 0), ('bulk', 1), ('bulk', 2)
+  ]
+
+@has_event_loop('event_loop')
+class Cruncher:
+  def __init__(self):
+    self.content = []
+
+  @slot(executor = 'thread')
+  def crunch(self, value):
+    time.sleep(0.05)
+    self.content.append((value, threading.get_ident()))
+    return value * 2
+
+  @slot(executor = 'process')
+  def crunchInProcess(value):
+    return (value * 2, os.getpid())
+
+@pytest.mark.asyncio
+async def test_thread_executor_slot():
+  cruncher = Cruncher()
+  ticks = []
+  async def tick():
+    while True:
+      ticks.append(None)
+      await asyncio.sleep(0.01)
+  ticker = asyncio.create_task(tick())
+  async with cruncher.event_loop:
+    results = [ cruncher.crunch(i) for i in range(3) ]
+    assert [ await result for result in results ] == [ 0, 2, 4 ]
+  ticker.cancel()
+  assert [ value for value, thread in cruncher.content ] == [ 0, 1, 2 ]
+  assert all(thread != threading.get_ident() for value, thread in cruncher.content)
+  assert len(ticks) > 5
+
+@pytest.mark.asyncio
+async def test_process_executor_slot():
+  cruncher = Cruncher()
+  async with cruncher.event_loop:
+    result, pid = await cruncher.crunchInProcess(21)
+  assert result == 42
+  assert pid != os.getpid()
+
+@has_event_loop('event_loop')
+class ThreadRecorder:
+  def __init__(self):
+    self.content = []
+
+  @slot
+  def record(self, value):
+    self.content.append((value, threading.get_ident()))
+    return value
+
+@pytest.mark.asyncio
+async def test_enqueue_from_foreign_thread():
+  recorder = ThreadRecorder()
+  async with recorder.event_loop:
+    def produce():
+      return [ recorder.record(i) for i in range(100) ]
+    futures = await asyncio.get_running_loop().run_in_executor(None, produce)
+    assert all(isinstance(future, concurrent.futures.Future) for future in futures)
+    results = await asyncio.gather(*[ asyncio.wrap_future(future) for future in futures ])
+  assert results == list(range(100))
+  assert recorder.content == [ (i, threading.get_ident()) for i in range(100) ]
+
+@pytest.mark.asyncio
+async def test_event_loop_thread():
+  recorder = ThreadRecorder()
+  setEventLoop(recorder, EventLoopThread())
+  recorder.record(0)
+  async with recorder.event_loop:
+    future = recorder.record(1)
+    assert await asyncio.wrap_future(future) == 1
+    recorder.record(2)
+  assert [ value for value, thread in recorder.content ] == [ 0, 1, 2 ]
+  assert all(thread == recorder.event_loop.thread.ident for value, thread in recorder.content)
+  assert not recorder.event_loop.thread.is_alive()
+
+def test_event_loop_thread_without_asyncio():
+  recorder = ThreadRecorder()
+  setEventLoop(recorder, EventLoopThread())
+  with recorder.event_loop:
+    assert recorder.record(1).result(timeout = 1) == 1
+  assert [ value for value, thread in recorder.content ] == [ 1 ]
+
+@has_event_loop('event_loop')
+@emits('events', [ 'result' ])
+class ShardedProducer:
+  @slot
+  def produce(self, value):
+    self.events.result(value, threading.get_ident())
+
+@pytest.mark.asyncio
+async def test_event_loop_group_marshals_between_shards():
+  producer = ShardedProducer()
+  consumer = ThreadRecorder()
+  producer_threads = []
+  connect(producer, 'result', lambda value, thread: producer_threads.append(thread))
+  connect(producer, 'result', lambda value, thread: consumer.record(value))
+  group = EventLoopGroup(2)
+  group.pin(producer)
+  group.pin(consumer)
+  assert producer.event_loop is not consumer.event_loop
+
+  async with group:
+    for i in range(100):
+      producer.produce(i)
+    while len(consumer.content) < 100:
+      await asyncio.sleep(0.01)
+
+  assert set(producer_threads) == { producer.event_loop.thread.ident }
+  assert consumer.content == [ (i, consumer.event_loop.thread.ident) for i in range(100) ]
+
+@has_event_loop('event_loop')
+class StateReceiver:
+  def __init__(self):
+    self.content = []
+
+  @slot(coalesce = True)
+  def onChanged(self, value):
+    self.content.append(value)
+
+  @slot(coalesce = lambda key, value: key)
+  def onKeyChanged(self, key, value):
+    self.content.append((key, value))
+
+  @slot(debounce = 0.05)
+  def onDebounced(self, value):
+    self.content.append(value)
+
+  @slot(throttle = 0.05)
+  def onThrottled(self, value):
+    self.content.append(value)
+
+@pytest.mark.asyncio
+async def test_coalescing_slot():
+  receiver = StateReceiver()
+  async with receiver.event_loop:
+    results = [ receiver.onChanged(i) for i in range(100) ]
+    assert all(result is results[0] for result in results)
+    await results[-1]
+    receiver.onChanged(100)
+  assert receiver.content == [ 99, 100 ]
+
+@pytest.mark.asyncio
+async def test_coalescing_slot_with_key():
+  receiver = StateReceiver()
+  async with receiver.event_loop:
+    for i in range(10):
+      receiver.onKeyChanged('a', i)
+      receiver.onKeyChanged('b', i)
+  assert receiver.content == [ ('a', 9), ('b', 9) ]
+
+@pytest.mark.asyncio
+async def test_debounced_slot():
+  receiver = StateReceiver()
+  async with receiver.event_loop:
+    for i in range(10):
+      receiver.onDebounced(i)
+      await asyncio.sleep(0.01)
+    assert receiver.content == []
+    await asyncio.sleep(0.1)
+    assert receiver.content == [ 9 ]
+    receiver.onDebounced(10)
+  assert receiver.content == [ 9, 10 ]
+
+@pytest.mark.asyncio
+async def test_throttled_slot():
+  receiver = StateReceiver()
+  async with receiver.event_loop:
+    for i in range(10):
+      receiver.onThrottled(i)
+    await asyncio.sleep(0.01)
+    assert receiver.content == [ 0 ]
+    await asyncio.sleep(0.1)
+    assert receiver.content == [ 0, 9 ]
+    receiver.onThrottled(10)
+    receiver.onThrottled(11)
+  assert receiver.content == [ 0, 9, 10, 11 ]
+
+@has_event_loop('event_loop')
+class SlowReceiver:
+  @slot
+  def onFast(self, value):
+    pass
+
+  @slot
+  def onSlow(self, value):
+    self.block(0.2)
+
+  def block(self, duration):
+    time.sleep(duration)
+
+@pytest.mark.asyncio
+async def test_slow_slot_event():
+  receiver = SlowReceiver()
+  setEventLoop(receiver, EventLoop(slow_slot_threshold = 0.1))
+  slow_slots = []
+  connect(receiver.event_loop, 'slow_slot', lambda *args: slow_slots.append(args))
+  async with receiver.event_loop:
+    receiver.onFast(0)
+    receiver.onSlow(1)
+  assert len(slow_slots) == 1
+  name, args, stack, duration = slow_slots[0]
+  assert name == 'SlowReceiver.onSlow'
+  assert '1' in args
+  assert 'self.block(0.2)' in ''.join(stack)
+  assert duration >= 0.2
+
+@pytest.mark.asyncio
+async def test_sampling_slot_monitor():
+  receiver = SlowReceiver()
+  setEventLoop(receiver, EventLoop(sample_interval = 0.01))
+  async with receiver.event_loop:
+    receiver.onSlow(1)
+  folded = receiver.event_loop.monitor.folded()
+  stack, count = folded.splitlines()[0].rsplit(' ', 1)
+  assert stack == 'SlowReceiver.onSlow;SlowReceiver.block'
+  assert int(count) > 5
+
+@pytest.mark.asyncio
+async def test_sampling_with_slow_slot_threshold():
+  receiver = SlowReceiver()
+  setEventLoop(receiver, EventLoop(slow_slot_threshold = 0.04, sample_interval = 0.05))
+  async with receiver.event_loop:
+    receiver.onSlow(1)
+  counts = [ int(line.rsplit(' ', 1)[1]) for line in receiver.event_loop.monitor.folded().splitlines() ]
+  assert 2 <= sum(counts) <= 5
+
+@has_event_loop('event_loop')
+class AwaitingReceiver:
+  @slot
+  async def onWait(self, duration):
+    await asyncio.sleep(duration)
+
+@pytest.mark.asyncio
+async def test_sampling_skips_other_event_loops():
+  awaiting_receiver = AwaitingReceiver()
+  setEventLoop(awaiting_receiver, EventLoop(sample_interval = 0.01))
+  slow_receiver = SlowReceiver()
+  async with awaiting_receiver.event_loop, slow_receiver.event_loop:
+    awaiting_receiver.onWait(0.3)
+    await asyncio.sleep(0.05)
+    await slow_receiver.onSlow(1)
+  folded = awaiting_receiver.event_loop.monitor.folded()
+  stacks = [ line.rsplit(' ', 1)[0] for line in folded.splitlines() ]
+  assert stacks == [ 'AwaitingReceiver.onWait' ]
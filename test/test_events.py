@@ -1,6 +1,7 @@
 # Copyright 2023 Ole Kliemann
 # SPDX-License-Identifier: GPL-3.0-or-later
 
+import gc
 from mreventloop import Events
 
 class Listener:
@@ -91,3 +92,54 @@ def test_dispatches_correctly_after_removing_listener():
   assert listener1_2.received == [ 'foo', 'bar', '456' ]
   assert listener2_1.received == [ 'baz', '123' ]
   assert listener2_2.received == [ 'baz', '123' ]
+
+def test_listener_removing_itself_does_not_skip_others():
+  listener1 = Listener()
+  listener2 = Listener()
+  events = Events([ 'event1' ])
+  def once(item):
+    events.event1.removeListener(once)
+  events.event1.addListener(once)
+  events.event1.addListener(listener1.slot)
+  events.event1.addListener(listener2.slot)
+  events.event1('foo')
+  events.event1('bar')
+  assert listener1.received == [ 'foo', 'bar' ]
+  assert listener2.received == [ 'foo', 'bar' ]
+
+def test_weak_listener_is_removed_when_receiver_dies():
+  listener1 = Listener()
+  listener2 = Listener()
+  received = listener2.received
+  events = Events([ 'event1' ])
+  events.event1.addListener(listener1.slot, weak = True)
+  events.event1.addListener(listener2.slot, weak = True)
+  events.event1('foo')
+  del listener2
+  gc.collect()
+  events.event1('bar')
+  assert listener1.received == [ 'foo', 'bar' ]
+  assert received == [ 'foo' ]
+  assert len(events.event1.listeners) == 1
+
+def test_weak_listener_hashes_like_bound_method():
+  listener1 = Listener()
+  listener2 = Listener()
+  events = Events([ 'event1' ])
+  events.event1.addListener(listener1.slot, weak = True)
+  events.event1.addListener(listener2.slot, weak = True)
+  weak1, weak2 = events.event1.listeners
+  assert weak1 == listener1.slot and hash(weak1) == hash(listener1.slot)
+  assert weak2 == listener2.slot and hash(weak2) == hash(listener2.slot)
+  assert listener1.slot in { weak1 }
+  assert len({ weak1, weak2 }) == 2
+
+def test_same_listener_added_twice_is_called_twice():
+  listener1 = Listener()
+  events = Events([ 'event1' ])
+  events.event1.addListener(listener1.slot)
+  events.event1.addListener(listener1.slot)
+  events.event1('foo')
+  events.event1.removeListener(listener1.slot)
+  events.event1('bar')
+  assert listener1.received == [ 'foo', 'foo', 'bar' ]
@@ -0,0 +1,84 @@
+# Copyright 2023 Ole Kliemann
+# SPDX-License-Identifier: GPL-3.0-or-later
+
+import os
+import tempfile
+from mreventloop import Journal
+from mreventloop.journal import decodeFrames
+
+def readAll(journal, sequence = 1):
+  return [ (s, [ bytes(frame) for frame in decodeFrames(record) ]) for s, record in journal.read(sequence) ]
+
+def test_append_and_read():
+  with tempfile.TemporaryDirectory() as directory:
+    journal = Journal(directory)
+    assert journal.append([ b'a\0', b'0' ]) == 1
+    assert journal.append([ b'b\0', b'1', b'' ]) == 2
+    assert readAll(journal) == [ (1, [ b'a\0', b'0' ]), (2, [ b'b\0', b'1', b'' ]) ]
+    assert readAll(journal, 2) == [ (2, [ b'b\0', b'1', b'' ]) ]
+    assert readAll(journal, 3) == []
+    journal.close()
+
+def test_segments_and_reopen():
+  with tempfile.TemporaryDirectory() as directory:
+    journal = Journal(directory, segment_size = 100)
+    for i in range(20):
+      journal.append([ b'a\0', str(i).encode() * 10 ])
+    assert len(os.listdir(directory)) > 1
+    assert [ s for s, frames in readAll(journal, 15) ] == list(range(15, 21))
+    journal.close()
+
+    journal = Journal(directory, segment_size = 100)
+    assert journal.next_sequence == 21
+    assert journal.append([ b'a\0' ]) == 21
+    assert [ s for s, frames in readAll(journal) ] == list(range(1, 22))
+    journal.close()
+
+def test_max_segments():
+  with tempfile.TemporaryDirectory() as directory:
+    journal = Journal(directory, segment_size = 1, max_segments = 3)
+    for i in range(10):
+      journal.append([ b'a\0', b'x' ])
+    assert len(os.listdir(directory)) == 3
+    assert [ s for s, frames in readAll(journal) ] == [ 8, 9, 10 ]
+    journal.close()
+
+def test_read_from_index():
+  with tempfile.TemporaryDirectory() as directory:
+    journal = Journal(directory)
+    for i in range(1000):
+      journal.append([ b'a\0', str(i).encode() ])
+    assert readAll(journal, 990)[0] == (990, [ b'a\0', b'989' ])
+    segment = journal._segments[-1]
+    assert 0 < segment.offset(100) < segment.offset(990)
+    records = journal.read(10)
+    assert next(records)[0] == 10
+    mapping = segment._map
+    journal.append([ b'a\0', b'1000' ])
+    assert next(journal.read(10))[0] == 10
+    assert segment._map is mapping
+    assert readAll(journal, 1001) == [ (1001, [ b'a\0', b'1000' ]) ]
+    del records
+    journal.close()
+
+    journal = Journal(directory)
+    assert readAll(journal, 1001) == [ (1001, [ b'a\0', b'1000' ]) ]
+    journal.close()
+
+def test_reopen_with_empty_or_truncated_tail():
+  with tempfile.TemporaryDirectory() as directory:
+    journal = Journal(directory, segment_size = 1)
+    for i in range(5):
+      journal.append([ b'a\0', str(i).encode() ])
+    journal.close()
+    open(os.path.join(directory, f'{6:020d}.journal'), 'wb').close()
+    journal = Journal(directory, segment_size = 1)
+    assert journal.append([ b'a\0', b'5' ]) == 6
+    journal.close()
+    with open(os.path.join(directory, f'{7:020d}.journal'), 'wb') as f:
+      f.write(b'\0\0\0')
+    journal = Journal(directory)
+    assert journal.append([ b'a\0', b'6' ]) == 7
+    assert [ s for s, frames in readAll(journal) ] == list(range(1, 8))
+    assert readAll(journal, 7) == [ (7, [ b'a\0', b'6' ]) ]
+    journal.close()
@@ -0,0 +1,147 @@
+# Copyright 2023 Ole Kliemann
+# SPDX-License-Identifier: GPL-3.0-or-later
+
+import asyncio
+import pytest
+import tempfile
+import threading
+import zmq
+import mreventloop.broker
+from mreventloop import slot, connect, EventLoop, setEventLoop, has_event_loop, Peer, Broker
+from mreventloop import Metrics, PrometheusExporter
+
+@has_event_loop('event_loop')
+class Receiver:
+  def __init__(self):
+    self.content = []
+
+  @slot
+  def onValue(self, value):
+    self.content.append(value)
+
+  @slot
+  def onFail(self):
+    raise RuntimeError()
+
+@pytest.mark.asyncio
+async def test_event_loop_metrics():
+  metrics = Metrics()
+  receiver = Receiver()
+  setEventLoop(receiver, EventLoop(exit_on_exception = False, metrics = metrics, name = 'receiver'))
+  for i in range(10):
+    receiver.onValue(i)
+  receiver.onFail()
+  assert metrics.snapshot()['mreventloop_queue_depth'] == { (('loop', 'receiver'),): 11 }
+  async with receiver.event_loop:
+    pass
+
+  snapshot = metrics.snapshot()
+  value_labels = (('loop', 'receiver'), ('slot', 'Receiver.onValue'))
+  fail_labels = (('loop', 'receiver'), ('slot', 'Receiver.onFail'))
+  assert snapshot['mreventloop_queue_depth'] == { (('loop', 'receiver'),): 0 }
+  assert snapshot['mreventloop_slot_calls_total'] == { value_labels: 10, fail_labels: 1 }
+  assert snapshot['mreventloop_slot_exceptions_total'] == { fail_labels: 1 }
+  assert snapshot['mreventloop_slot_duration_seconds'][value_labels]['count'] == 10
+  assert snapshot['mreventloop_slot_latency_seconds'][fail_labels]['count'] == 1
+  buckets = snapshot['mreventloop_slot_latency_seconds'][value_labels]['buckets']
+  assert buckets[float('inf')] == 10
+
+def test_prometheus_text():
+  metrics = Metrics(buckets = (0.1, 1.0))
+  metrics.inc('calls_total', (('slot', 'a"b'),), 2)
+  metrics.gauge('depth', (), lambda: 3)
+  metrics.observe('duration_seconds', (('slot', 'a'),), 0.5)
+  assert metrics.toPrometheus() == (
+    '# TYPE calls_total counter\n'
+    'calls_total{slot="a\\"b"} 2\n'
+    '# TYPE depth gauge\n'
+    'depth 3\n'
+    '# TYPE duration_seconds histogram\n'
+    'duration_seconds_bucket{slot="a",le="0.1"} 0\n'
+    'duration_seconds_bucket{slot="a",le="1.0"} 1\n'
+    'duration_seconds_bucket{slot="a",le="+Inf"} 1\n'
+    'duration_seconds_sum{slot="a"} 0.5\n'
+    'duration_seconds_count{slot="a"} 1\n'
+  )
+
+@pytest.mark.asyncio
+async def test_prometheus_exporter():
+  metrics = Metrics()
+  metrics.inc('calls_total')
+  async with PrometheusExporter(metrics, port = 0) as exporter:
+    reader, writer = await asyncio.open_connection('127.0.0.1', exporter.port)
+    writer.write(b'GET /metrics HTTP/1.0\r\n\r\n')
+    response = await reader.read()
+    writer.close()
+  assert response.startswith(b'HTTP/1.0 200 OK\r\n')
+  assert response.endswith(b'\r\n\r\n# TYPE calls_total counter\ncalls_total 1\n')
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize('proxy', [ True, False ])
+async def test_peer_and_broker_metrics(proxy):
+  with tempfile.NamedTemporaryFile(
+      prefix = 'in_socket',
+      suffix = '.ipc',
+      delete = True
+  ) as in_socket_file, \
+    tempfile.NamedTemporaryFile(
+      prefix = 'out_socket',
+      suffix = '.ipc',
+      delete = True
+  ) as out_socket_file:
+    in_socket_path = f'ipc://{in_socket_file.name}'
+    out_socket_path = f'ipc://{out_socket_file.name}'
+    metrics = Metrics()
+    broker = Broker(in_socket_path, out_socket_path, proxy = proxy, metrics = metrics, name = 'broker')
+    producer_peer = Peer(in_socket_path, out_socket_path, [], [ 'value' ], metrics = metrics, name = 'producer')
+    consumer_peer = Peer(in_socket_path, out_socket_path, [ 'value' ], [], metrics = metrics, name = 'consumer')
+    receiver = Receiver()
+    connect(consumer_peer, 'value', receiver, 'onValue')
+
+    async with broker, producer_peer, consumer_peer, receiver.event_loop:
+      await asyncio.sleep(0.1)
+      for i in range(3):
+        await producer_peer.publish.value(i)
+      for i in range(0, 100):
+        if len(receiver.content) == 3:
+          break
+        await asyncio.sleep(0.01)
+      messages = metrics.snapshot()['mreventloop_messages_total']
+
+    assert receiver.content == [ 0, 1, 2 ]
+    assert messages[(('worker', 'producer'), ('direction', 'out'))] == 3
+    assert messages[(('worker', 'consumer'), ('direction', 'in'))] == 3
+    assert messages[(('worker', 'broker'), ('direction', 'in'))] == 3
+    assert messages[(('worker', 'broker'), ('direction', 'out'))] == 3
+    assert metrics.snapshot()['mreventloop_bytes_total'][(('worker', 'producer'), ('direction', 'out'))] > 0
+
+def test_metrics_from_threads():
+  metrics = Metrics()
+  def count():
+    for i in range(10000):
+      metrics.inc('counted_total', (('thread', 'any'),))
+      metrics.observe('observed_seconds', (), 0.001)
+  threads = [ threading.Thread(target = count) for i in range(4) ]
+  for thread in threads:
+    thread.start()
+  for thread in threads:
+    thread.join()
+  snapshot = metrics.snapshot()
+  assert snapshot['counted_total'][(('thread', 'any'),)] == 40000
+  assert snapshot['observed_seconds'][()]['count'] == 40000
+
+def test_proxy_statistics_do_not_hang_without_proxy(monkeypatch):
+  monkeypatch.setattr(mreventloop.broker, '_proxy_statistics_timeout', 50)
+  metrics = Metrics()
+  broker = Broker('inproc://unused-out', 'inproc://unused-in', metrics = metrics, name = 'broker')
+  ctx = zmq.Context.instance()
+  dead_proxy = ctx.socket(zmq.PAIR)
+  dead_proxy.bind('inproc://dead-proxy-control')
+  broker._proxy_control_out = ctx.socket(zmq.PAIR)
+  broker._proxy_control_out.connect('inproc://dead-proxy-control')
+  metrics.collector(broker._collectProxyStatistics)
+  assert 'mreventloop_messages_total' not in metrics.snapshot()
+  broker._proxy_control_out.close()
+  dead_proxy.close()
+  broker.in_socket.close()
+  broker.out_socket.close()
@@ -1,10 +1,15 @@
 # Copyright 2023 Ole Kliemann
 # SPDX-License-Identifier: GPL-3.0-or-later
 
+import json
 import asyncio
 import pytest
 import tempfile
+import zmq
+import zmq.asyncio
 from mreventloop import emits, slot, forwards, connect, EventLoop, setEventLoop, has_event_loop, Peer, Broker
+from mreventloop import JsonRpcCodec, BinaryCodec, RpcError, Metrics, Journal, LastValueCache
+from mreventloop import SharedSockets, sharedContext
 import logging
 
 logger = logging.getLogger(__name__)
@@ -66,7 +71,8 @@ class Consumer:
     self.events.request_produce_b(x, y)
 
 @pytest.mark.asyncio
-async def test_two_peers():
+@pytest.mark.parametrize('proxy', [ True, False ])
+async def test_two_peers(proxy):
   with tempfile.NamedTemporaryFile(
       prefix = 'in_socket',
       suffix = '.ipc',
@@ -79,7 +85,7 @@ async def test_two_peers():
   ) as out_socket_file:
     in_socket_path = f'ipc://{in_socket_file.name}'
     out_socket_path = f'ipc://{out_socket_file.name}'
-    broker = Broker(in_socket_path, out_socket_path)
+    broker = Broker(in_socket_path, out_socket_path, proxy = proxy)
     producer_peer = Peer(
       in_socket_path, out_socket_path,
       [ 'request_produce_a', 'request_produce_b' ],
@@ -102,6 +108,7 @@ async def test_two_peers():
     connect(consumer_peer, 'produced', consumer, 'onProduced')
 
     async with broker, producer_peer, consumer_peer, producer.event_loop, consumer.event_loop:
+      await asyncio.sleep(0.1)
       coros = []
       coros.append(consumer.requestProduceA())
       coros.append(consumer.requestProduceA())
@@ -119,7 +126,8 @@ async def test_two_peers():
     assert consumer.content == [ '1', '2', '3', '3', '6', '7' ]
 
 @pytest.mark.asyncio
-async def test_three_peers():
+@pytest.mark.parametrize('codec', [ JsonRpcCodec, BinaryCodec ])
+async def test_three_peers(codec):
   with tempfile.NamedTemporaryFile(
       prefix = 'in_socket',
       suffix = '.ipc',
@@ -136,17 +144,20 @@ async def test_three_peers():
     producer_a_peer = Peer(
       in_socket_path, out_socket_path,
       [ 'request_produce_a' ],
-      [ 'produced' ]
+      [ 'produced' ],
+      codec = codec()
     )
     producer_b_peer = Peer(
       in_socket_path, out_socket_path,
       [ 'request_produce_b' ],
-      [ 'produced' ]
+      [ 'produced' ],
+      codec = codec()
     )
     consumer_peer = Peer(
       in_socket_path, out_socket_path,
       [ 'produced' ],
-      [ 'request_produce_a', 'request_produce_b' ]
+      [ 'request_produce_a', 'request_produce_b' ],
+      codec = codec()
     )
 
     producer_a = ProducerOnlyA()
@@ -169,18 +180,778 @@ async def test_three_peers():
     producer_a.event_loop, \
     producer_b.event_loop, \
     consumer.event_loop:
-      coros = []
-      coros.append(consumer.requestProduceA())
-      coros.append(consumer.requestProduceA())
-      coros.append(consumer.requestProduceA())
-      coros.append(consumer.requestProduceB(0, 0))
-      coros.append(consumer.requestProduceB(2, 1))
-      coros.append(consumer.requestProduceA())
-      await asyncio.gather(*coros)
+      await asyncio.sleep(0.1)
+      # replies of different producers are not ordered, so wait for each one
+      requests = [
+        lambda: consumer.requestProduceA(),
+        lambda: consumer.requestProduceA(),
+        lambda: consumer.requestProduceA(),
+        lambda: consumer.requestProduceB(0, 0),
+        lambda: consumer.requestProduceB(2, 1),
+        lambda: consumer.requestProduceA(),
+      ]
+      for n, request in enumerate(requests, 1):
+        await request()
+        for i in range(0, 100):
+          if len(consumer.content) == n:
+            break
+          await asyncio.sleep(0.01)
+      print('done')
+
+    assert consumer.content == [ '1', '2', '3', '0', '3', '4' ]
+
+class CountingCodec(JsonRpcCodec):
+  def __init__(self):
+    self.decoded = []
+
+  def decode(self, data):
+    event_name, args = super().decode(data)
+    self.decoded.append(event_name)
+    return event_name, args
+
+@pytest.mark.asyncio
+async def test_peer_only_receives_subscribed_events():
+  with tempfile.NamedTemporaryFile(
+      prefix = 'in_socket',
+      suffix = '.ipc',
+      delete = True
+  ) as in_socket_file, \
+    tempfile.NamedTemporaryFile(
+      prefix = 'out_socket',
+      suffix = '.ipc',
+      delete = True
+  ) as out_socket_file:
+    in_socket_path = f'ipc://{in_socket_file.name}'
+    out_socket_path = f'ipc://{out_socket_file.name}'
+    broker = Broker(in_socket_path, out_socket_path)
+    producer_peer = Peer(
+      in_socket_path, out_socket_path,
+      [],
+      [ 'produced', 'produced_other', 'other' ]
+    )
+    codec = CountingCodec()
+    consumer_peer = Peer(
+      in_socket_path, out_socket_path,
+      [ 'produced' ],
+      [],
+      codec = codec
+    )
+
+    consumer = Consumer()
+    connect(consumer_peer, 'produced', consumer, 'onProduced')
+
+    async with broker, producer_peer, consumer_peer, consumer.event_loop:
+      await asyncio.sleep(0.1)
+      for i in range(3):
+        await producer_peer.publish.other(i)
+        await producer_peer.publish.produced_other(i)
+        await producer_peer.publish.produced(str(i))
       for i in range(0, 100):
-        if len(consumer.content) == 6:
+        if len(consumer.content) == 3:
           break
         await asyncio.sleep(0.01)
-      print('done')
 
-    assert consumer.content == [ '1', '2', '3', '0', '3', '4' ]
+    assert consumer.content == [ '0', '1', '2' ]
+    assert codec.decoded == [ 'produced' ] * 3
+
+@has_event_loop('event_loop')
+class Collector:
+  def __init__(self):
+    self.content = []
+
+  @slot
+  def onA(self, value):
+    self.content.append(('a', value))
+
+  @slot
+  def onB(self, value):
+    self.content.append(('b', value))
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize('batch_size,batch_time,messages', [ (None, None, 3), (2, None, 4), (None, 0.2, 3) ])
+async def test_batched_publish(batch_size, batch_time, messages):
+  with tempfile.NamedTemporaryFile(
+      prefix = 'in_socket',
+      suffix = '.ipc',
+      delete = True
+  ) as in_socket_file, \
+    tempfile.NamedTemporaryFile(
+      prefix = 'out_socket',
+      suffix = '.ipc',
+      delete = True
+  ) as out_socket_file:
+    in_socket_path = f'ipc://{in_socket_file.name}'
+    out_socket_path = f'ipc://{out_socket_file.name}'
+    broker = Broker(in_socket_path, out_socket_path)
+    producer_peer = Peer(
+      in_socket_path, out_socket_path,
+      [],
+      [ 'a', 'b' ],
+      publish_batch_size = batch_size,
+      publish_batch_time = batch_time
+    )
+    consumer_peer = Peer(
+      in_socket_path, out_socket_path,
+      [ 'a', 'b' ],
+      []
+    )
+
+    sent = []
+    send_multipart = producer_peer._out_socket.send_multipart
+    def countingSendMultipart(frames, **kwargs):
+      sent.append(len(frames) - 1)
+      return send_multipart(frames, **kwargs)
+    producer_peer._out_socket.send_multipart = countingSendMultipart
+
+    collector = Collector()
+    connect(consumer_peer, 'a', collector, 'onA')
+    connect(consumer_peer, 'b', collector, 'onB')
+
+    async with broker, producer_peer, consumer_peer, collector.event_loop:
+      await asyncio.sleep(0.1)
+      for i in range(3):
+        producer_peer.publish.a(i)
+      producer_peer.publish.b(3)
+      producer_peer.publish.a(4)
+      published = producer_peer.publish.a(5)
+      start = asyncio.get_running_loop().time()
+      await producer_peer.event_loop.enqueue(lambda: None)
+      assert asyncio.get_running_loop().time() - start < 0.1
+      await published
+      for i in range(0, 100):
+        if len(collector.content) == 6:
+          break
+        await asyncio.sleep(0.01)
+
+    assert collector.content == [ ('a', 0), ('a', 1), ('a', 2), ('b', 3), ('a', 4), ('a', 5) ]
+    assert len(sent) == messages
+
+@has_event_loop('event_loop')
+class Calculator:
+  @slot
+  def add(self, x, y):
+    return x + y
+
+  @slot
+  async def slowAdd(self, x, y):
+    await asyncio.sleep(0.01 * x)
+    return x + y
+
+  @slot
+  def fail(self):
+    raise ValueError('failed')
+
+def fail():
+  raise ValueError('failed')
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize('codec', [ JsonRpcCodec, BinaryCodec ])
+async def test_remote_call(codec):
+  with tempfile.TemporaryDirectory() as directory:
+    in_socket_path = f'ipc://{directory}/in.sock'
+    out_socket_path = f'ipc://{directory}/out.sock'
+    rpc_socket_path = f'ipc://{directory}/rpc.sock'
+    broker = Broker(in_socket_path, out_socket_path, rpc_socket_path = rpc_socket_path)
+    server_peer = Peer(in_socket_path, out_socket_path, [], [], codec = codec(), rpc_socket_path = rpc_socket_path)
+    client_peer = Peer(
+      in_socket_path, out_socket_path, [], [],
+      codec = codec(),
+      rpc_socket_path = rpc_socket_path,
+      rpc_timeout = 1
+    )
+    calculator = Calculator()
+    calculator.event_loop = EventLoop(exit_on_exception = False)
+    server_peer.serve('add', calculator.add)
+    server_peer.serve('slow_add', calculator.slowAdd)
+    server_peer.serve('fail_slot', calculator.fail)
+    server_peer.serve('fail', fail)
+    server_peer.serve('never', lambda: asyncio.sleep(10))
+
+    async with broker, server_peer, client_peer, calculator.event_loop:
+      await asyncio.sleep(0.1)
+      assert await client_peer.call.add(1, 2) == 3
+      results = await asyncio.gather(*[ client_peer.call.slow_add(i, i) for i in range(5, 0, -1) ])
+      assert results == [ 10, 8, 6, 4, 2 ]
+      with pytest.raises(RpcError, match = 'ValueError: failed'):
+        await client_peer.call.fail_slot()
+      with pytest.raises(RpcError, match = 'ValueError: failed'):
+        await client_peer.call.fail()
+      with pytest.raises(RpcError):
+        await client_peer.call.unknown()
+      with pytest.raises(asyncio.TimeoutError):
+        await client_peer.call.never()
+      assert await client_peer.call.add('a', 'b') == 'ab'
+      server_peer.serve('late_add', calculator.add)
+      await asyncio.sleep(0.05)
+      assert await client_peer.call.late_add(2, 3) == 5
+
+@pytest.mark.asyncio
+async def test_malformed_rpc_messages():
+  with tempfile.TemporaryDirectory() as directory:
+    in_socket_path = f'ipc://{directory}/in.sock'
+    out_socket_path = f'ipc://{directory}/out.sock'
+    rpc_socket_path = f'ipc://{directory}/rpc.sock'
+    broker = Broker(in_socket_path, out_socket_path, rpc_socket_path = rpc_socket_path)
+    server_peer = Peer(in_socket_path, out_socket_path, [], [], rpc_socket_path = rpc_socket_path)
+    client_peer = Peer(in_socket_path, out_socket_path, [], [], rpc_socket_path = rpc_socket_path, rpc_timeout = 1)
+    client_peer.rpc.socket.setsockopt(zmq.IDENTITY, b'client')
+    calculator = Calculator()
+    server_peer.serve('add', calculator.add)
+
+    async with broker, server_peer, client_peer, calculator.event_loop:
+      ctx = zmq.asyncio.Context()
+      socket = ctx.socket(zmq.DEALER)
+      socket.connect(rpc_socket_path)
+      for message in [
+        [ b'CALL' ],
+        [ b'CALL', b'id' ],
+        [ b'REPLAY', b'id' ],
+        [ b'REPLAY', b'id', b'short' ],
+        [ b'REPLY', b'client' ],
+        [ b'REPLY', b'client', b'id' ],
+        [ b'REPLY', b'client', b'\0' * 8, b'ERROR' ],
+      ]:
+        await socket.send_multipart(message)
+      await asyncio.sleep(0.1)
+      assert await client_peer.call.add(1, 2) == 3
+      socket.close(0)
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize('consumer_first', [ True, False ])
+async def test_direct_events(consumer_first):
+  with tempfile.TemporaryDirectory() as directory:
+    in_socket_path = f'ipc://{directory}/in.sock'
+    out_socket_path = f'ipc://{directory}/out.sock'
+    rpc_socket_path = f'ipc://{directory}/rpc.sock'
+    metrics = Metrics()
+    broker = Broker(
+      in_socket_path, out_socket_path,
+      proxy = False,
+      metrics = metrics,
+      name = 'broker',
+      rpc_socket_path = rpc_socket_path
+    )
+    producer_peer = Peer(
+      in_socket_path, out_socket_path,
+      [],
+      [ 'a', 'b' ],
+      rpc_socket_path = rpc_socket_path,
+      direct_socket_path = f'ipc://{directory}/producer.sock',
+      direct_event_names = [ 'a' ]
+    )
+    consumer_peer = Peer(in_socket_path, out_socket_path, [ 'a', 'b' ], [], rpc_socket_path = rpc_socket_path)
+    collector = Collector()
+    connect(consumer_peer, 'a', collector, 'onA')
+    connect(consumer_peer, 'b', collector, 'onB')
+
+    peers = [ consumer_peer, producer_peer ] if consumer_first else [ producer_peer, consumer_peer ]
+    async with broker:
+      async with peers[0], peers[1], collector.event_loop:
+        await asyncio.sleep(0.2)
+        for i in range(3):
+          await producer_peer.publish.a(i)
+          await producer_peer.publish.b(i)
+        for i in range(0, 100):
+          if len(collector.content) == 6:
+            break
+          await asyncio.sleep(0.01)
+      await asyncio.sleep(0.1)
+      directory, watchers = broker.rpc._directory, broker.rpc._watchers
+
+    # direct and brokered events are only ordered among themselves
+    assert [ item for item in collector.content if item[0] == 'a' ] == [ ('a', 0), ('a', 1), ('a', 2) ]
+    assert [ item for item in collector.content if item[0] == 'b' ] == [ ('b', 0), ('b', 1), ('b', 2) ]
+    assert metrics.snapshot()['mreventloop_messages_total'][(('worker', 'broker'), ('direction', 'in'))] == 3
+    assert directory == {}
+    assert watchers == {}
+
+@pytest.mark.asyncio
+async def test_direct_events_of_vanished_peer():
+  with tempfile.TemporaryDirectory() as directory:
+    in_socket_path = f'ipc://{directory}/in.sock'
+    out_socket_path = f'ipc://{directory}/out.sock'
+    rpc_socket_path = f'ipc://{directory}/rpc.sock'
+    broker = Broker(in_socket_path, out_socket_path, rpc_socket_path = rpc_socket_path)
+    consumer_peer = Peer(in_socket_path, out_socket_path, [ 'a' ], [], rpc_socket_path = rpc_socket_path)
+    announced = []
+    consumer_peer.rpc.events.announced.addListener(lambda path, event_name: announced.append(path))
+
+    async with broker:
+      ctx = zmq.asyncio.Context()
+      vanished_socket = ctx.socket(zmq.DEALER)
+      vanished_socket.connect(rpc_socket_path)
+      await vanished_socket.send_multipart([ b'ANNOUNCE', f'ipc://{directory}/vanished.sock'.encode(), b'a' ])
+      await asyncio.sleep(0.1)
+      assert list(broker.rpc._directory) == [ b'a' ]
+      vanished_socket.close(0)
+      await asyncio.sleep(0.1)
+      async with consumer_peer:
+        await asyncio.sleep(0.1)
+      await asyncio.sleep(0.1)
+      assert broker.rpc._directory == {}
+      assert broker.rpc._watchers == {}
+    assert announced == []
+
+@pytest.mark.asyncio
+async def test_replay_from_journal():
+  with tempfile.TemporaryDirectory() as directory:
+    in_socket_path = f'ipc://{directory}/in.sock'
+    out_socket_path = f'ipc://{directory}/out.sock'
+    rpc_socket_path = f'ipc://{directory}/rpc.sock'
+    broker = Broker(
+      in_socket_path, out_socket_path,
+      rpc_socket_path = rpc_socket_path,
+      journal = Journal(f'{directory}/journal')
+    )
+    broker.rpc.replay_page_size = 2
+    producer_peer = Peer(in_socket_path, out_socket_path, [], [ 'a', 'b' ])
+
+    async def waitFor(collector, count):
+      for i in range(0, 100):
+        if len(collector.content) == count:
+          break
+        await asyncio.sleep(0.01)
+
+    async with broker, producer_peer:
+      await asyncio.sleep(0.1)
+      for i in range(3):
+        await producer_peer.publish.a(i)
+        await producer_peer.publish.b(i)
+      await asyncio.sleep(0.1)
+
+      consumer_peer = Peer(
+        in_socket_path, out_socket_path, [ 'a' ], [],
+        rpc_socket_path = rpc_socket_path,
+        replay_from = 1
+      )
+      collector = Collector()
+      connect(consumer_peer, 'a', collector, 'onA')
+      async with consumer_peer, collector.event_loop:
+        await waitFor(collector, 3)
+        assert collector.content == [ ('a', 0), ('a', 1), ('a', 2) ]
+        await asyncio.sleep(0.1)
+        await producer_peer.publish.a(3)
+        await waitFor(collector, 4)
+      assert collector.content == [ ('a', 0), ('a', 1), ('a', 2), ('a', 3) ]
+      sequence = consumer_peer.sequence
+      assert sequence == 7
+
+      for i in range(4, 6):
+        await producer_peer.publish.a(i)
+
+      consumer_peer = Peer(
+        in_socket_path, out_socket_path, [ 'a' ], [],
+        rpc_socket_path = rpc_socket_path,
+        replay_from = sequence + 1
+      )
+      collector = Collector()
+      connect(consumer_peer, 'a', collector, 'onA')
+      async with consumer_peer, collector.event_loop:
+        await waitFor(collector, 2)
+      assert collector.content == [ ('a', 4), ('a', 5) ]
+
+@pytest.mark.asyncio
+async def test_replay_from_removed_segments():
+  with tempfile.TemporaryDirectory() as directory:
+    in_socket_path = f'ipc://{directory}/in.sock'
+    out_socket_path = f'ipc://{directory}/out.sock'
+    rpc_socket_path = f'ipc://{directory}/rpc.sock'
+    broker = Broker(
+      in_socket_path, out_socket_path,
+      rpc_socket_path = rpc_socket_path,
+      journal = Journal(f'{directory}/journal', segment_size = 1, max_segments = 3)
+    )
+    producer_peer = Peer(in_socket_path, out_socket_path, [], [ 'a' ])
+
+    async with broker, producer_peer:
+      await asyncio.sleep(0.1)
+      for i in range(6):
+        await producer_peer.publish.a(i)
+      await asyncio.sleep(0.1)
+
+      consumer_peer = Peer(
+        in_socket_path, out_socket_path, [ 'a' ], [],
+        rpc_socket_path = rpc_socket_path,
+        replay_from = 2
+      )
+      gaps = []
+      consumer_peer.peer_events.gap.addListener(lambda *args: gaps.append(args))
+      collector = Collector()
+      connect(consumer_peer, 'a', collector, 'onA')
+      async with consumer_peer, collector.event_loop:
+        for i in range(0, 100):
+          if len(collector.content) == 3:
+            break
+          await asyncio.sleep(0.01)
+
+    assert gaps == [ ('a', None, 2, 3) ]
+    assert collector.content == [ ('a', 3), ('a', 4), ('a', 5) ]
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize('codec,expected', [
+  (None, [ ('y', 3) ]),
+  (JsonRpcCodec(), [ ('x', 2), ('y', 3) ]),
+])
+async def test_last_value_cache(codec, expected):
+  with tempfile.TemporaryDirectory() as directory:
+    in_socket_path = f'ipc://{directory}/in.sock'
+    out_socket_path = f'ipc://{directory}/out.sock'
+    broker = Broker(in_socket_path, out_socket_path, last_value_cache = LastValueCache(codec))
+    producer_peer = Peer(in_socket_path, out_socket_path, [], [ 'a', 'b' ])
+
+    async with broker, producer_peer:
+      await asyncio.sleep(0.1)
+      await producer_peer.publish.a('x', 1)
+      await producer_peer.publish.a('x', 2)
+      await producer_peer.publish.a('y', 3)
+      await producer_peer.publish.b('z', 4)
+      await asyncio.sleep(0.1)
+
+      consumer_peer = Peer(in_socket_path, out_socket_path, [ 'a' ], [])
+      content = []
+      connect(consumer_peer, 'a', lambda key, value: content.append((key, value)))
+      async with consumer_peer:
+        for i in range(0, 100):
+          if len(content) == len(expected):
+            break
+          await asyncio.sleep(0.01)
+        await asyncio.sleep(0.05)
+
+    assert content == expected
+
+def test_last_value_cache_keys_named_params():
+  cache = LastValueCache(JsonRpcCodec())
+  topic = b'a\0'
+  for key, value in [ ('x', 1), ('x', 2), ('y', 3) ]:
+    payload = json.dumps({ 'jsonrpc': '2.0', 'method': 'a', 'params': { 'key': key, 'value': value } })
+    cache.store([ topic, payload.encode() ])
+  values = cache._topics[topic]
+  assert list(values) == [ 'x', 'y' ]
+  assert json.loads(values['x'][1])['params'] == { 'key': 'x', 'value': 2 }
+
+@pytest.mark.asyncio
+async def test_last_value_cache_with_sequenced_events():
+  with tempfile.TemporaryDirectory() as directory:
+    in_socket_path = f'ipc://{directory}/in.sock'
+    out_socket_path = f'ipc://{directory}/out.sock'
+    broker = Broker(in_socket_path, out_socket_path, last_value_cache = LastValueCache(JsonRpcCodec()))
+    producer_peer = Peer(in_socket_path, out_socket_path, [], [ 'a' ], sequenced = True)
+    early_peer = Peer(in_socket_path, out_socket_path, [ 'a' ], [])
+    late_peer = Peer(in_socket_path, out_socket_path, [ 'a' ], [])
+    contents = { early_peer: [], late_peer: [] }
+    gaps = []
+    for peer, content in contents.items():
+      connect(peer, 'a', lambda key, value, content = content: content.append((key, value)))
+      peer.peer_events.gap.addListener(lambda *args: gaps.append(args))
+
+    async with broker, producer_peer, early_peer:
+      await asyncio.sleep(0.1)
+      await producer_peer.publish.a('x', 1)
+      await producer_peer.publish.a('y', 2)
+      await producer_peer.publish.a('x', 3)
+      await producer_peer.publish.a('x', 4)
+      await asyncio.sleep(0.1)
+      async with late_peer:
+        await asyncio.sleep(0.1)
+        await producer_peer.publish.a('y', 5)
+        await asyncio.sleep(0.1)
+
+    assert contents[early_peer] == [ ('x', 1), ('y', 2), ('x', 3), ('x', 4), ('y', 5) ]
+    assert contents[late_peer] == [ ('y', 2), ('x', 4), ('y', 5) ]
+    assert gaps == []
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize('retransmit_buffer,expected,gaps', [
+  (0, [ 0, 1, 4, 5, 7 ], [ (2, 3), (6, 6) ]),
+  (100, [ 0, 1, 2, 3, 4, 5, 6, 7 ], []),
+  (2, [ 0, 1, 4, 5, 6, 7 ], [ (2, 3) ]),
+])
+async def test_sequenced_events(retransmit_buffer, expected, gaps):
+  with tempfile.TemporaryDirectory() as directory:
+    in_socket_path = f'ipc://{directory}/in.sock'
+    out_socket_path = f'ipc://{directory}/out.sock'
+    rpc_socket_path = f'ipc://{directory}/rpc.sock' if retransmit_buffer else None
+    broker = Broker(in_socket_path, out_socket_path, rpc_socket_path = rpc_socket_path)
+    producer_peer = Peer(
+      in_socket_path, out_socket_path, [], [ 'a' ],
+      rpc_socket_path = rpc_socket_path,
+      sequenced = True,
+      retransmit_buffer = retransmit_buffer
+    )
+    consumer_peer = Peer(in_socket_path, out_socket_path, [ 'a' ], [], rpc_socket_path = rpc_socket_path)
+    collector = Collector()
+    connect(consumer_peer, 'a', collector, 'onA')
+    detected_gaps = []
+    consumer_peer.peer_events.gap.addListener(
+      lambda event_name, publisher_id, first, last: detected_gaps.append((first - 1, last - 1))
+    )
+
+    sent = 0
+    send_multipart = producer_peer._out_socket.send_multipart
+    def lossySendMultipart(frames, **kwargs):
+      nonlocal sent
+      sent += 1
+      if sent in [ 3, 4, 7 ]:
+        return asyncio.sleep(0)
+      return send_multipart(frames, **kwargs)
+    producer_peer._out_socket.send_multipart = lossySendMultipart
+
+    async with broker, producer_peer, consumer_peer, collector.event_loop:
+      await asyncio.sleep(0.1)
+      for i in range(8):
+        await producer_peer.publish.a(i)
+        if retransmit_buffer == 2 and i == 5:
+          await asyncio.sleep(0.1)
+      for i in range(0, 100):
+        if len(collector.content) == len(expected):
+          break
+        await asyncio.sleep(0.01)
+
+    assert collector.content == [ ('a', i) for i in expected ]
+    assert detected_gaps == gaps
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize('heartbeat_interval,gaps', [ (None, []), (0.05, [ (2, 3) ]) ])
+async def test_heartbeat_detects_lost_last_events(heartbeat_interval, gaps):
+  with tempfile.TemporaryDirectory() as directory:
+    in_socket_path = f'ipc://{directory}/in.sock'
+    out_socket_path = f'ipc://{directory}/out.sock'
+    broker = Broker(in_socket_path, out_socket_path)
+    producer_peer = Peer(
+      in_socket_path, out_socket_path, [], [ 'a' ],
+      sequenced = True,
+      heartbeat_interval = heartbeat_interval
+    )
+    consumer_peer = Peer(in_socket_path, out_socket_path, [ 'a' ], [])
+    collector = Collector()
+    connect(consumer_peer, 'a', collector, 'onA')
+    detected_gaps = []
+    consumer_peer.peer_events.gap.addListener(
+      lambda event_name, publisher_id, first, last: detected_gaps.append((first - 1, last - 1))
+    )
+
+    sent = 0
+    send_multipart = producer_peer._out_socket.send_multipart
+    def lossySendMultipart(frames, **kwargs):
+      nonlocal sent
+      sent += len(frames) - 1
+      if len(frames) > 1 and sent in [ 3, 4 ]:
+        return asyncio.sleep(0)
+      return send_multipart(frames, **kwargs)
+    producer_peer._out_socket.send_multipart = lossySendMultipart
+
+    async with broker, producer_peer, consumer_peer, collector.event_loop:
+      await asyncio.sleep(0.1)
+      for i in range(4):
+        await producer_peer.publish.a(i)
+      await asyncio.sleep(0.2)
+
+    assert collector.content == [ ('a', 0), ('a', 1) ]
+    assert detected_gaps == gaps
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize('publish_overflow', [ 'drop', 'block' ])
+async def test_publish_overflow(publish_overflow):
+  with tempfile.TemporaryDirectory() as directory:
+    in_socket_path = f'ipc://{directory}/in.sock'
+    out_socket_path = f'ipc://{directory}/out.sock'
+    ctx = zmq.asyncio.Context()
+    stalled_socket = ctx.socket(zmq.SUB)
+    stalled_socket.setsockopt(zmq.RCVHWM, 1)
+    stalled_socket.setsockopt(zmq.SUBSCRIBE, b'')
+    stalled_socket.bind(out_socket_path)
+    idle_socket = ctx.socket(zmq.PUB)
+    idle_socket.bind(in_socket_path)
+
+    metrics = Metrics()
+    producer_peer = Peer(
+      in_socket_path, out_socket_path, [], [ 'a' ],
+      metrics = metrics,
+      name = 'producer',
+      socket_options = { 'out': { zmq.SNDHWM: 1, zmq.LINGER: 0 } },
+      publish_overflow = publish_overflow
+    )
+    flow_events = []
+    for event_name in [ 'blocked', 'unblocked', 'dropped' ]:
+      getattr(producer_peer.peer_events, event_name).addListener(
+        lambda *args, event_name = event_name: flow_events.append(event_name)
+      )
+
+    payload = 'x' * 100000
+    async with producer_peer:
+      await asyncio.sleep(0.1)
+      stalled_socket.getsockopt(zmq.EVENTS)
+      await asyncio.sleep(0.1)
+      for i in range(20):
+        producer_peer.publish.a(i, payload)
+      for i in range(0, 100):
+        if flow_events:
+          break
+        await asyncio.sleep(0.01)
+      received = 0
+      if publish_overflow == 'block':
+        while received < 20:
+          await stalled_socket.recv_multipart()
+          received += 1
+      await producer_peer.publish.a(20, '')
+
+    snapshot = metrics.snapshot()
+    labels = (('worker', 'producer'), ('event', 'a'))
+    if publish_overflow == 'drop':
+      assert set(flow_events) == { 'dropped' }
+      assert snapshot['mreventloop_send_dropped_total'][labels] == flow_events.count('dropped')
+    else:
+      assert flow_events[:2] == [ 'blocked', 'unblocked' ]
+      assert flow_events.count('blocked') == flow_events.count('unblocked')
+      assert snapshot['mreventloop_send_blocked_total'][labels] == flow_events.count('blocked')
+      assert 'mreventloop_send_dropped_total' not in snapshot
+    assert snapshot['mreventloop_queue_depth'][(('loop', 'producer'),)] == 0
+    stalled_socket.close(0)
+    idle_socket.close(0)
+
+@pytest.mark.asyncio
+async def test_broker_publish_overflow():
+  with tempfile.TemporaryDirectory() as directory:
+    in_socket_path = f'ipc://{directory}/in.sock'
+    out_socket_path = f'ipc://{directory}/out.sock'
+    metrics = Metrics()
+    broker = Broker(
+      in_socket_path, out_socket_path,
+      metrics = metrics,
+      name = 'broker',
+      socket_options = { 'out': { zmq.SNDHWM: 1 } },
+      publish_overflow = 'drop'
+    )
+    assert not broker.proxy
+    dropped = []
+    broker.events.dropped.addListener(lambda event_name, count: dropped.append((event_name, count)))
+    producer_peer = Peer(in_socket_path, out_socket_path, [], [ 'a' ])
+
+    ctx = zmq.asyncio.Context()
+    stalled_socket = ctx.socket(zmq.SUB)
+    stalled_socket.setsockopt(zmq.RCVHWM, 1)
+    stalled_socket.setsockopt(zmq.SUBSCRIBE, b'')
+
+    payload = 'x' * 100000
+    async with broker, producer_peer:
+      stalled_socket.connect(in_socket_path)
+      await asyncio.sleep(0.1)
+      stalled_socket.getsockopt(zmq.EVENTS)
+      await asyncio.sleep(0.1)
+      for i in range(20):
+        await producer_peer.publish.a(i, payload)
+      for i in range(0, 100):
+        if dropped:
+          break
+        await asyncio.sleep(0.01)
+
+    assert dropped and set(dropped) == { ('a', 1) }
+    snapshot = metrics.snapshot()
+    labels = (('worker', 'broker'), ('event', 'a'))
+    assert snapshot['mreventloop_send_dropped_total'][labels] == len(dropped)
+    stalled_socket.close(0)
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize('transport', [ 'ipc', 'inproc' ])
+async def test_shared_sockets(transport):
+  with tempfile.TemporaryDirectory() as directory:
+    if transport == 'ipc':
+      in_socket_path = f'ipc://{directory}/in.sock'
+      out_socket_path = f'ipc://{directory}/out.sock'
+    else:
+      in_socket_path = f'inproc://{directory}/in'
+      out_socket_path = f'inproc://{directory}/out'
+    broker = Broker(in_socket_path, out_socket_path)
+    producer_peer = Peer(in_socket_path, out_socket_path, [], [ 'a' ])
+    shared_sockets = SharedSockets(in_socket_path, out_socket_path)
+    a_peer = Peer(in_socket_path, out_socket_path, [ 'a' ], [ 'b' ], shared_sockets = shared_sockets)
+    ab_peer = Peer(in_socket_path, out_socket_path, [ 'a', 'b' ], [], shared_sockets = shared_sockets)
+    assert a_peer._in_socket is ab_peer._in_socket
+    assert broker.ctx is producer_peer._ctx is shared_sockets.ctx is sharedContext()
+
+    a_collector = Collector()
+    connect(a_peer, 'a', a_collector, 'onA')
+    ab_collector = Collector()
+    connect(ab_peer, 'a', ab_collector, 'onA')
+    connect(ab_peer, 'b', ab_collector, 'onB')
+
+    async with broker, producer_peer, a_peer, ab_peer, a_collector.event_loop, ab_collector.event_loop:
+      await asyncio.sleep(0.1)
+      await producer_peer.publish.a(0)
+      await asyncio.sleep(0.05)
+      await a_peer.publish.b(1)
+      for i in range(0, 100):
+        if len(a_collector.content) == 1 and len(ab_collector.content) == 2:
+          break
+        await asyncio.sleep(0.01)
+
+    assert a_collector.content == [ ('a', 0) ]
+    assert ab_collector.content == [ ('a', 0), ('b', 1) ]
+    assert shared_sockets.in_socket.closed
+
+@pytest.mark.asyncio
+async def test_shared_sockets_reentered():
+  with tempfile.TemporaryDirectory() as directory:
+    in_socket_path = f'ipc://{directory}/in.sock'
+    out_socket_path = f'ipc://{directory}/out.sock'
+    broker = Broker(in_socket_path, out_socket_path)
+    shared_sockets = SharedSockets(in_socket_path, out_socket_path)
+    consumer_peer = Peer(in_socket_path, out_socket_path, [ 'a' ], [])
+    collector = Collector()
+    connect(consumer_peer, 'a', collector, 'onA')
+
+    async with broker, consumer_peer, collector.event_loop:
+      for i in range(3):
+        producer_peer = Peer(in_socket_path, out_socket_path, [], [ 'a' ], shared_sockets = shared_sockets)
+        async with producer_peer:
+          await asyncio.sleep(0.1)
+          await producer_peer.publish.a(i)
+          await asyncio.sleep(0.05)
+        assert shared_sockets.out_socket.closed
+
+    assert collector.content == [ ('a', 0), ('a', 1), ('a', 2) ]
+
+@pytest.mark.asyncio
+async def test_shared_sockets_bound_inboxes():
+  with tempfile.TemporaryDirectory() as directory:
+    in_socket_path = f'ipc://{directory}/in.sock'
+    out_socket_path = f'ipc://{directory}/out.sock'
+    shared_sockets = SharedSockets(in_socket_path, out_socket_path, socket_options = { 'in': { zmq.RCVHWM: 2 } })
+    with pytest.raises(ValueError):
+      Peer(in_socket_path, f'ipc://{directory}/other.sock', [ 'a' ], [], shared_sockets = shared_sockets)
+    with pytest.raises(ValueError):
+      Peer(in_socket_path, out_socket_path, [ 'a' ], [], shared_sockets = shared_sockets, publish_overflow = 'drop')
+    metrics = Metrics()
+    peer = Peer(in_socket_path, out_socket_path, [ 'a' ], [], shared_sockets = shared_sockets, metrics = metrics, name = 'a')
+    dropped = []
+    peer.peer_events.dropped.addListener(lambda event_name, count: dropped.append((event_name, count)))
+    for i in range(4):
+      peer._deliver([ zmq.Frame(b'a\0'), zmq.Frame(b'x'), zmq.Frame(b'y') ])
+    assert peer._inbox.qsize() == 2
+    assert dropped == [ ('a', 2), ('a', 2) ]
+    assert metrics.snapshot()['mreventloop_send_dropped_total'][(('worker', 'a'), ('event', 'a'))] == 4
+
+@pytest.mark.asyncio
+async def test_shared_sockets_failing_to_connect():
+  shared_sockets = SharedSockets('nonsense://in', 'nonsense://out')
+  peers = [ Peer('nonsense://in', 'nonsense://out', [ 'a' ], [], shared_sockets = shared_sockets) for i in range(2) ]
+  for peer in peers:
+    with pytest.raises(zmq.ZMQError):
+      async with peer:
+        pass
+  assert shared_sockets.in_socket.closed
+  assert shared_sockets.out_socket.closed
+
+def test_shared_context_io_threads_after_sockets(caplog):
+  ctx = sharedContext()
+  io_threads = ctx.get(zmq.IO_THREADS)
+  socket = ctx.socket(zmq.PUB)
+  try:
+    with caplog.at_level(logging.WARNING, logger = 'mreventloop.context'):
+      sharedContext(io_threads = io_threads)
+      assert not caplog.records
+      sharedContext(io_threads = io_threads + 1)
+    assert 'no effect' in caplog.text
+  finally:
+    socket.close()
+    ctx.set(zmq.IO_THREADS, io_threads)
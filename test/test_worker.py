@@ -0,0 +1,44 @@
+# Copyright 2023 Ole Kliemann
+# SPDX-License-Identifier: GPL-3.0-or-later
+
+import asyncio
+import pytest
+from mreventloop import Worker
+
+class IdleWorker(Worker):
+  def __init__(self):
+    super().__init__()
+    self.never = asyncio.get_event_loop().create_future()
+    self.runs = 0
+
+  async def _run(self):
+    self.runs += 1
+    await self._receive(lambda: self.never)
+
+class QueueWorker(Worker):
+  def __init__(self):
+    super().__init__()
+    self.queue = asyncio.Queue()
+    self.content = []
+
+  async def _run(self):
+    item = await self._receive(self.queue.get)
+    self.content.append(item)
+
+@pytest.mark.asyncio
+async def test_idle_worker_does_not_poll_and_stops_immediately():
+  worker = IdleWorker()
+  async with worker:
+    await asyncio.sleep(0.3)
+  assert worker.runs == 1
+  assert worker.main.done()
+
+@pytest.mark.asyncio
+async def test_worker_receives_until_stopped():
+  worker = QueueWorker()
+  async with worker:
+    for i in range(3):
+      worker.queue.put_nowait(i)
+    while len(worker.content) < 3:
+      await asyncio.sleep(0.01)
+  assert worker.content == [ 0, 1, 2 ]